@@ -0,0 +1,287 @@
+import sys
+import time
+import logging
+import threading
+import multiprocessing
+from logging.handlers import QueueHandler
+from logging.handlers import QueueListener
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from bat.DicomHandler import plain_value
+from bat.ImageHandler import ImageHandler
+from bat.GeometryCache import Geometry_Cache
+
+
+class ImageRecord:
+    """
+    The compact result of one analyzed file.
+    It has the same attribute names as ImageHandler for the fields used by
+    SQL3Handler, so it can be stored instead of the whole ImageHandler.
+    """
+    Fields = ("Uid", "Modality", "SerialNumber", "KVP", "Current", "Kernel",
+              "TotalCollimation", "OriginalCollimation", "SliceThickness",
+              "TotalSlice", "Instance", "DateTime", "ScanMode")
+
+    def __init__(self, filename):
+        self.FileName = filename
+        self.isImageComplete = False
+        self.Error = None
+        self.Image_Median_Filter_Result = None
+        # {output file name: image bytes} if the images are not saved by the worker
+        self.Images = {}
+        # the Geometry_Cache counters of this file in the process which analyzed it
+        self.GeometryCounters = {}
+        for field in self.Fields:
+            setattr(self, field, None)
+
+    @classmethod
+    def from_image(cls, image: ImageHandler):
+        """
+        :param image: an initialized ImageHandler
+        :return: an ImageRecord
+        """
+        record = cls(image.FileName)
+        for field in cls.Fields:
+            setattr(record, field, plain_value(getattr(image, field)))
+        record.Image_Median_Filter_Result = image.Image_Median_Filter_Result
+        record.isImageComplete = True
+        return record
+
+
+def needs_iq_evaluation(image):
+    """
+    Decide if the IQ evaluation shall be drawn for the image.
+    :param image: an ImageHandler
+    :return: True or False
+    """
+    if image.Kernel == "Hr40f" and image.OriginalCollimation in (16, 1, 32, 64):
+        return True
+    if image.Kernel == "Br40f" and image.OriginalCollimation in (16, 32) and image.KVP == 130:
+        return True
+    return False
+
+
+def analyze_file(filename, window=(70, -5), data=None, save=True, pixels=None):
+    """
+    Analyze one file and save its images. It runs in a worker process.
+    :param filename: dicom file name including path
+    :param window: the window to save the image
+    :param data: the content of the dicom file as bytes if it is already read
+    :param save: save the images at the dicom path. If False, the rendered
+    images are returned in ImageRecord.Images
+    :param pixels: the decoded pixel data if data is the header only. See DicomHandler
+    :return: an ImageRecord. If anything goes wrong, isImageComplete is False
+    and Error contains the reason.
+    """
+    before = Geometry_Cache.counters()
+    record = _analyze(filename, window, data, save, pixels)
+    after = Geometry_Cache.counters()
+    # the cache of a worker process is not visible to the main process
+    record.GeometryCounters = {name: after[name] - before[name] for name in after}
+    return record
+
+
+def _analyze(filename, window, data, save, pixels):
+    try:
+        image = ImageHandler(filename, window=window, data=data, pixels=pixels)
+        if not image.isImageComplete:
+            record = ImageRecord(filename)
+            record.Error = r"Image initialed incomplete."
+            return record
+        if save:
+            image.save_image()
+            if needs_iq_evaluation(image):
+                image.draw_sorted_iq_result(100, 2)
+            return ImageRecord.from_image(image)
+        record = ImageRecord.from_image(image)
+        record.Images.update(image.render_image())
+        if needs_iq_evaluation(image):
+            record.Images.update(image.render_iq_image(100, 2))
+        return record
+    except Exception as e:
+        logging.error(str(filename) + ": " + str(e))
+        record = ImageRecord(filename)
+        record.Error = str(e)
+        return record
+
+
+class Progress:
+    """
+    Show the progress as count, throughput and ETA on one console line.
+    """
+
+    def __init__(self, total=None, stream=sys.stdout):
+        """
+        :param total: the total number of files, None if unknown
+        :param stream: where to write the progress
+        """
+        self.Total = total
+        self.Count = 0
+        self.Stream = stream
+        self.StartTime = time.time()
+
+    def update(self, count=1, note=""):
+        """
+        :param count: the number of newly finished files
+        :param note: extra text shown at the end of the line
+        """
+        self.Count += count
+        elapsed = time.time() - self.StartTime
+        rate = self.Count / elapsed if elapsed > 0 else 0.0
+        if self.Total is None:
+            self.Stream.write(f"\r{self.Count:d}: {rate:.1f} files/s {note}")
+        else:
+            eta = (self.Total - self.Count) / rate if rate > 0 else 0.0
+            self.Stream.write(f"\r{self.Count:d}/{self.Total:d}: {rate:.1f} files/s, ETA {eta:.0f}s {note}")
+        self.Stream.flush()
+
+
+def init_worker(log_queue, level):
+    """
+    Send the log records of a worker process to the parent process, it is the
+    initializer of the pool. A spawned worker does not have the logging
+    configuration of the parent, and a forked one must not write the log file itself.
+    :param log_queue: a multiprocessing queue read by a QueueListener in the parent
+    :param level: the level of the root logger
+    :return: no return
+    """
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(QueueHandler(log_queue))
+    root.setLevel(level)
+
+
+class BatchExecutor:
+    """
+    Analyze files in a process pool, it is the compute stage of BatchPipeline.
+    The record of each file is given to done, in the order the files finish;
+    BatchPipeline puts them back into the input order with the tag.
+    A crashed worker breaks the whole pool and all the files in it fail with it.
+    These files are run again one at a time in a new pool, so only a file which
+    crashes its worker alone gives a failed ImageRecord, and the run goes on.
+    """
+    # how many times a file is retried alone after it crashed its worker process
+    Broken_Retry = 1
+
+    def __init__(self, jobs, done):
+        """
+        :param jobs: number of worker processes
+        :param done: a function called as done(record, tag) for each file.
+        It is called from the threads of the pool, or from the thread calling isolate.
+        """
+        self.Jobs = max(1, jobs)
+        self.Done = done
+        # the log records of the workers are handled by the handlers of this process
+        self.__log_queue = multiprocessing.Queue()
+        self.__log_listener = QueueListener(self.__log_queue, *logging.getLogger().handlers,
+                                            respect_handler_level=True)
+        self.__log_listener.start()
+        self.__pool = self.__new_pool()
+        # the files of a broken pool, as (filename, function, arguments, tag)
+        self.__suspects = []
+        self.__lock = threading.Lock()
+
+    def submit(self, filename, function=analyze_file, arguments=(), tag=None):
+        """
+        Submit a file to the pool.
+        :param filename: dicom file name including path
+        :param function: analyze_file, or a function with the same first parameter
+        :param arguments: the other parameters of function
+        :param tag: any value given back to done with the record
+        :return: no return
+        """
+        self.isolate()
+        item = (filename, function, arguments, tag)
+        try:
+            future = self.__pool.submit(function, filename, *arguments)
+        except BrokenProcessPool:
+            with self.__lock:
+                self.__suspects.append(item)
+            self.isolate()
+            return
+        future.add_done_callback(lambda f: self.__finished(item, f))
+
+    @property
+    def isBroken(self):
+        """
+        True if files of a broken pool are waiting for isolate.
+        """
+        with self.__lock:
+            return bool(self.__suspects)
+
+    def isolate(self):
+        """
+        Start a new pool if the pool is broken, and run its files again one at a time,
+        so the file which crashes its worker is found. It blocks until they are done.
+        :return: no return
+        """
+        if not self.isBroken:
+            return
+        # all files of the broken pool fail at once, wait until they are all suspects
+        self.__pool.shutdown(wait=True)
+        self.__pool = self.__new_pool()
+        with self.__lock:
+            suspects, self.__suspects = self.__suspects, []
+        logging.error(r"Worker process crashed, run " + str(len(suspects)) +
+                      " files again one at a time.")
+        for item in suspects:
+            self.Done(self.__run_alone(*item[:3]), item[3])
+
+    def shutdown(self):
+        """
+        Wait for all submitted files, including the files run again by isolate.
+        :return: no return
+        """
+        self.__pool.shutdown(wait=True)
+        self.isolate()
+        self.__pool.shutdown(wait=True)
+        self.__log_listener.stop()
+        self.__log_queue.close()
+
+    def __new_pool(self):
+        return ProcessPoolExecutor(max_workers=self.Jobs, initializer=init_worker,
+                                   initargs=(self.__log_queue, logging.getLogger().level))
+
+    def __finished(self, item, future):
+        """
+        Give the record of a finished future to done, it runs in a thread of the pool.
+        A file of a broken pool is kept for isolate.
+        """
+        filename, tag = item[0], item[3]
+        try:
+            record = future.result()
+        except BrokenProcessPool:
+            with self.__lock:
+                self.__suspects.append(item)
+            return
+        except Exception as e:
+            logging.error(str(filename) + ": " + str(e))
+            record = ImageRecord(filename)
+            record.Error = str(e)
+        self.Done(record, tag)
+
+    def __run_alone(self, filename, function, arguments):
+        """
+        Run one file while no other file is in the pool.
+        :return: an ImageRecord, failed if the file crashes its worker again and again
+        """
+        for _ in range(self.Broken_Retry + 1):
+            try:
+                return self.__pool.submit(function, filename, *arguments).result()
+            except BrokenProcessPool:
+                logging.error(str(filename) + r" crashed its worker process.")
+                self.__pool.shutdown(wait=False)
+                self.__pool = self.__new_pool()
+            except Exception as e:
+                logging.error(str(filename) + ": " + str(e))
+                record = ImageRecord(filename)
+                record.Error = str(e)
+                return record
+        record = ImageRecord(filename)
+        record.Error = r"Worker process crashed."
+        return record
+
+
+if __name__ == '__main__':
+    print("please do not use it individually unless of debugging.")
@@ -0,0 +1,322 @@
+import time
+import queue
+import logging
+import threading
+from bat.BatchExecutor import BatchExecutor
+from bat.BatchExecutor import ImageRecord
+from bat.BatchExecutor import Progress
+from bat.BatchExecutor import analyze_file
+from bat.DicomHandler import split_pixel_data
+from bat.GeometryCache import add_counters
+from bat.SharedMemoryHandler import SlabPool
+from bat.SharedMemoryHandler import Shared_Memory_Available
+from bat.SharedMemoryHandler import attach
+
+
+def analyze_shared(filename, window, header, descriptor):
+    """
+    analyze_file for a file whose pixel data is in a SlabPool slot.
+    It runs in a worker process.
+    :param filename: dicom file name including path
+    :param window: the window to save the image
+    :param header: the header of the dicom file as bytes, see split_pixel_data
+    :param descriptor: the descriptor of the slot, see SlabPool.put
+    :return: an ImageRecord
+    """
+    return analyze_file(filename, window, header, False, attach(descriptor))
+
+
+class BatchPipeline:
+    """
+    Analyze files as a pipeline of stages connected by bounded queues:
+        feeder -> readers (threads, read the file bytes)
+               -> dispatcher -> compute (processes, ImageHandler math)
+               -> writer (the calling thread, saves images and stores records)
+    So reading the disk, the calculation and the writing overlap.
+    The files finish in any order, the writer gives the records to store in the
+    order of the file names, so the database insertion order does not depend on scheduling.
+    The queues and the number of files in computation are bounded, so the
+    memory stays bounded whatever the number of files is.
+    With worker processes, the readers also decode the pixel data into a shared
+    memory SlabPool, so only the header and a slot descriptor are sent to the workers.
+    """
+    # marks the end of a queue
+    _End = None
+    # seconds between two checks for a broken pool while a stage waits
+    Poll_Interval = 0.5
+
+    def __init__(self, jobs=1, readers=4, window=(70, -5), queue_size=16,
+                 batch_size=100, report_interval=5.0, total=None, shared_memory=True,
+                 store_interval=2.0):
+        """
+        :param jobs: number of worker processes, 1 to compute in a thread of this process
+        :param readers: number of threads to read the files
+        :param window: the window to save the image
+        :param queue_size: the max number of files waiting in each queue, and in computation
+        :param batch_size: the max number of records given to store at once
+        :param report_interval: seconds between two reports of the queue depths
+        :param total: the estimated number of files for the ETA, None if unknown.
+        It is corrected when all files are found.
+        :param shared_memory: give the pixel data to the worker processes by shared memory.
+        It is ignored before python 3.8, the file content is pickled to the workers then.
+        :param store_interval: the max seconds a record waits in a batch which is not full
+        """
+        self.Jobs = max(1, jobs)
+        self.Readers = max(1, readers)
+        self.Window = window
+        self.QueueSize = max(1, queue_size)
+        self.BatchSize = max(1, batch_size)
+        self.StoreInterval = store_interval
+        self.ReportInterval = report_interval
+        self.SharedMemory = shared_memory
+        self.Progress = Progress(total)
+        # the Geometry_Cache counters summed over all files, see ImageRecord.GeometryCounters
+        self.GeometryCounters = {}
+        self.__slab_pool = None
+        self.__path_queue = None
+        self.__read_queue = None
+        self.__write_queue = None
+        self.__in_flight = None
+        self.__in_flight_count = 0
+        self.__lock = threading.Lock()
+
+    def run(self, filenames, store):
+        """
+        Run the pipeline until all files are stored.
+        :param filenames: an iterable of dicom file names, can be a generator
+        :param store: a function called by the writer with a list of ImageRecord.
+        Failed files are also given, with isImageComplete False.
+        The records are given in the order of filenames.
+        :return: the number of records given to store
+        """
+        self.__path_queue = queue.Queue(maxsize=self.QueueSize)
+        self.__read_queue = queue.Queue(maxsize=self.QueueSize)
+        # not bounded by itself, it holds at most QueueSize records due to __in_flight
+        self.__write_queue = queue.Queue()
+        self.__in_flight = threading.BoundedSemaphore(self.QueueSize)
+        self.__in_flight_count = 0
+        if self.Jobs > 1 and self.SharedMemory and Shared_Memory_Available:
+            # enough slots for the read queue, the readers and the files in computation
+            self.__slab_pool = SlabPool(2 * self.QueueSize + self.Readers)
+
+        threads = [threading.Thread(target=self.__feed, args=(filenames,), daemon=True),
+                   threading.Thread(target=self.__dispatch, daemon=True)]
+        threads += [threading.Thread(target=self.__read, daemon=True)
+                    for _ in range(self.Readers)]
+        for thread in threads:
+            thread.start()
+        try:
+            count = self.__write(store)
+            for thread in threads:
+                thread.join()
+        finally:
+            if self.__slab_pool is not None:
+                self.__slab_pool.close()
+                self.__slab_pool = None
+        self.report()
+        return count
+
+    def report(self):
+        """
+        Log the depth of each queue. The fullest stage is waiting on the next one,
+        the emptiest stage is the bottleneck.
+        :return: the depths as a dict
+        """
+        depths = {"paths": self.__path_queue.qsize(),
+                  "read": self.__read_queue.qsize(),
+                  "computing": self.__in_flight_count,
+                  "write": self.__write_queue.qsize()}
+        logging.info(r"Pipeline queues: " + str(depths))
+        return depths
+
+    def __feed(self, filenames):
+        """
+        Put the file names with their sequence number into the path queue,
+        it runs in its own thread.
+        """
+        count = 0
+        try:
+            for filename in filenames:
+                self.__path_queue.put((count, filename))
+                count += 1
+                # the given total is an estimate, it can be exceeded
+                if self.Progress.Total is not None and count > self.Progress.Total:
+                    self.Progress.Total = count
+            # all files are found, the total is known now
+            self.Progress.Total = count
+        except Exception as e:
+            logging.error(str(e))
+        finally:
+            for _ in range(self.Readers):
+                self.__path_queue.put(self._End)
+
+    def __read(self):
+        """
+        Read the whole content of each file, it runs in several threads.
+        The read queue gets (sequence, file name, data, slot, descriptor). If the pixel data
+        is put in the SlabPool, data is the header only, else slot is None.
+        """
+        while True:
+            item = self.__path_queue.get()
+            if item is self._End:
+                self.__read_queue.put(self._End)
+                return
+            sequence, filename = item
+            try:
+                with open(filename, "rb") as f:
+                    data = f.read()
+            except OSError as e:
+                logging.error(str(e))
+                self.__read_queue.put((sequence, filename, None, None, None))
+                continue
+            slot, descriptor = None, None
+            if self.__slab_pool is not None:
+                try:
+                    header, pixels = split_pixel_data(data)
+                    if self.__slab_pool.fits(pixels):
+                        slot, descriptor = self.__slab_pool.put(pixels)
+                        data = header
+                except Exception as e:
+                    # the worker gives the error of this file
+                    logging.debug(str(filename) + ": " + str(e))
+            self.__read_queue.put((sequence, filename, data, slot, descriptor))
+
+    def __dispatch(self):
+        """
+        Give the read files to the compute stage, it runs in its own thread.
+        It waits if QueueSize files are already in computation.
+        """
+        executor = BatchExecutor(self.Jobs, self.__computed) if self.Jobs > 1 else None
+        ended = 0
+        try:
+            while ended < self.Readers:
+                item = self.__next_read(executor)
+                if item is self._End:
+                    ended += 1
+                    continue
+                sequence, filename, data, slot, descriptor = item
+                # the files of a broken pool may hold all the in flight places
+                while not self.__in_flight.acquire(timeout=self.Poll_Interval):
+                    if executor is not None:
+                        executor.isolate()
+                with self.__lock:
+                    self.__in_flight_count += 1
+                if data is None:
+                    record = ImageRecord(filename)
+                    record.Error = r"File can not be read."
+                    self.__write_queue.put((sequence, record))
+                elif executor is None:
+                    self.__write_queue.put((sequence, analyze_file(filename, self.Window, data, False)))
+                elif slot is None:
+                    executor.submit(filename, analyze_file, (self.Window, data, False),
+                                    (sequence, slot))
+                else:
+                    executor.submit(filename, analyze_shared, (self.Window, data, descriptor),
+                                    (sequence, slot))
+        finally:
+            if executor is not None:
+                executor.shutdown()
+            self.__write_queue.put(self._End)
+
+    def __next_read(self, executor):
+        """
+        Get the next item of the read queue. While waiting, the files of a broken pool
+        are run again, so they do not wait for the readers.
+        :param executor: the BatchExecutor, or None
+        :return: an item of the read queue
+        """
+        while True:
+            try:
+                return self.__read_queue.get(timeout=self.Poll_Interval)
+            except queue.Empty:
+                if executor is not None:
+                    executor.isolate()
+
+    def __computed(self, record, tag):
+        """
+        Put the record of a file into the write queue.
+        The slot is recycled, the worker does not use it any more.
+        :param tag: a tuple as (sequence, slot)
+        """
+        sequence, slot = tag
+        if slot is not None:
+            self.__slab_pool.release(slot)
+        self.__write_queue.put((sequence, record))
+
+    def __write(self, store):
+        """
+        Save the images and store the records in batches, it runs in the calling thread.
+        A batch is stored when it is full, or when no more record is waiting
+        and the last batch was stored StoreInterval ago.
+        The records are put into the batches in the order of the file names. A record
+        which finishes early waits in a buffer, without its images as they are written.
+        :return: the number of records given to store
+        """
+        batch = []
+        count = 0
+        # {sequence: record} of the records waiting for an earlier file
+        waiting = {}
+        next_sequence = 0
+        last_report = last_store = time.time()
+        while True:
+            try:
+                item = self.__write_queue.get(timeout=self.ReportInterval)
+            except queue.Empty:
+                pass
+            else:
+                if item is self._End:
+                    break
+                sequence, record = item
+                self.__in_flight.release()
+                with self.__lock:
+                    self.__in_flight_count -= 1
+                self.save_images(record)
+                add_counters(self.GeometryCounters, record.GeometryCounters)
+                # the images are written, do not keep them until the batch is stored
+                record.Images = {}
+                waiting[sequence] = record
+                while next_sequence in waiting:
+                    batch.append(waiting.pop(next_sequence))
+                    next_sequence += 1
+                self.Progress.update()
+            if len(batch) >= self.BatchSize or \
+               (batch and self.__write_queue.empty() and
+                    time.time() - last_store >= self.StoreInterval):
+                count += self.__store(store, batch)
+                batch = []
+                last_store = time.time()
+            if time.time() - last_report >= self.ReportInterval:
+                depths = self.report()
+                self.Progress.update(0, " ".join(k + ":" + str(v) for k, v in depths.items()))
+                last_report = last_store = time.time()
+        # every file gives one record, so nothing is left unless a stage failed
+        batch += [waiting[sequence] for sequence in sorted(waiting)]
+        if batch:
+            count += self.__store(store, batch)
+        return count
+
+    @staticmethod
+    def __store(store, batch):
+        try:
+            store(batch)
+        except Exception as e:
+            logging.error(str(e))
+        return len(batch)
+
+    @staticmethod
+    def save_images(record):
+        """
+        Write the rendered images of a record next to its dicom file.
+        :param record: an ImageRecord
+        :return: no return
+        """
+        for name, data in record.Images.items():
+            try:
+                with open(name, "wb") as f:
+                    f.write(data)
+            except OSError as e:
+                logging.error(str(e))
+
+
+if __name__ == '__main__':
+    print("please do not use it individually unless of debugging.")
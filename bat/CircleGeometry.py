@@ -0,0 +1,114 @@
+import numpy as np
+from bat.GeometryCache import Geometry_Cache
+
+
+def _build_bresenham_offsets(radius: int):
+    """
+    Build the pixel offsets visited by the bresenham circle of one radius.
+    The points are in the same order as ImageHandler.bresenham visits them
+    (8 symmetric points per step), and a pixel on the axis is listed twice
+    just as the loop counts it twice.
+    :param radius: the radius of the circle in PIXEL
+    :return: a tuple as (rows, cols) of int arrays relative to the center
+    """
+    x_list = []
+    y_list = []
+    x = 0
+    y = radius
+    d = 3 - 2 * radius
+    while x < y:
+        x_list.append(x)
+        y_list.append(y)
+        if d < 0:
+            d = d + 4 * x + 6
+        else:
+            d = d + 4 * (x - y) + 10
+            y -= 1
+        x += 1
+    x = np.array(x_list, dtype=np.intp)
+    y = np.array(y_list, dtype=np.intp)
+    rows = np.stack((-y, y, -y, y, -x, -x, x, x), axis=1).ravel()
+    cols = np.stack((x, x, -x, -x, y, -y, y, -y), axis=1).ravel()
+    return rows, cols
+
+
+def _build_ring_offsets(max_radius: int):
+    """
+    Get the bresenham pixel offsets of all radius in range(1, max_radius)
+    together with the radius each offset belongs to.
+    :param max_radius: the first radius which is NOT included
+    :return: a tuple as (rows, cols, labels) of int arrays
+    """
+    rows = [np.zeros(0, dtype=np.intp)]
+    cols = [np.zeros(0, dtype=np.intp)]
+    labels = [np.zeros(0, dtype=np.intp)]
+    for radius in range(1, max_radius):
+        _rows, _cols = bresenham_offsets(radius)
+        rows.append(_rows)
+        cols.append(_cols)
+        labels.append(np.full(_rows.shape, radius, dtype=np.intp))
+    return np.concatenate(rows), np.concatenate(cols), np.concatenate(labels)
+
+
+def _build_ring_label_image(shape: tuple, center: tuple, max_radius: int):
+    """
+    Label every pixel of an image with its rounded distance to the center.
+    Pixels with a distance >= max_radius are labeled as max_radius.
+    :param shape: the image shape as (rows, cols)
+    :param center: a tuple indicates the circle center as (row, col)
+    :param max_radius: the first radius which is NOT labeled
+    :return: an int array with the given shape
+    """
+    rows = np.arange(shape[0]) - center[0]
+    cols = np.arange(shape[1]) - center[1]
+    distance = np.rint(np.hypot(rows[:, np.newaxis], cols[np.newaxis, :]))
+    return np.minimum(distance, max_radius).astype(np.intp)
+
+
+def _build_disk_weights(radius: int):
+    """
+    Build the weight kernel of a circular ROI as measured by
+    ImageHandler.roi_measure, i.e. how many times each pixel is counted by
+    the bresenham circles of radius in range(1, radius).
+    :param radius: the radius of the ROI in PIXEL
+    :return: a float array with shape (2 * radius + 1, 2 * radius + 1),
+    the ROI center is at (radius, radius)
+    """
+    rows, cols, _ = ring_offsets(radius)
+    weights = np.zeros((2 * radius + 1, 2 * radius + 1))
+    np.add.at(weights, (rows + radius, cols + radius), 1)
+    return weights
+
+
+def bresenham_offsets(radius: int):
+    """
+    Cached version of _build_bresenham_offsets. The arrays are read only.
+    """
+    return Geometry_Cache.get("bresenham_offsets", None, None, radius, "bresenham",
+                              lambda: _build_bresenham_offsets(radius))
+
+
+def ring_offsets(max_radius: int):
+    """
+    Cached version of _build_ring_offsets. The arrays are read only.
+    """
+    return Geometry_Cache.get("ring_offsets", None, None, max_radius, "bresenham",
+                              lambda: _build_ring_offsets(max_radius))
+
+
+def ring_label_image(shape: tuple, center: tuple, max_radius: int):
+    """
+    Cached version of _build_ring_label_image. The array is read only.
+    """
+    shape = (int(shape[0]), int(shape[1]))
+    center = (int(center[0]), int(center[1]))
+    return Geometry_Cache.get("ring_label_image", shape, center, max_radius, "euclidean",
+                              lambda: _build_ring_label_image(shape, center, max_radius))
+
+
+def disk_weights(radius: int):
+    """
+    Cached version of _build_disk_weights. The array is read only.
+    """
+    return Geometry_Cache.get("disk_weights", None, None, radius, "bresenham",
+                              lambda: _build_disk_weights(radius))
@@ -4,13 +4,363 @@ import numpy as np
 from bat.ImageHandler import ImageHandler
 
 
+# version of the BandAssessments schema, stored as "pragma user_version"
+# 0: integration_result as comma separated text
+# 1: integration_result as float32 blob with its dtype and length
+# 2: acquisition_datetime column and the indexes for QueryHandler
+# 3: BandTrends table
+Schema_Version = 3
+# the integration result is stored as little-endian float32
+Profile_Dtype = "<f4"
+# the columns of schema 1
+Table_Columns_1 = '''uid text primary key,
+                    modality text,
+                    serial_number integer,
+                    kvp real,
+                    current integer,
+                    kernel text,
+                    total_collimation real,
+                    slice_thickness real,
+                    slice_mode text,
+                    instance integer,
+                    integration_result blob,
+                    profile_dtype text,
+                    profile_length integer,
+                    comment text'''
+Table_Columns = Table_Columns_1 + ''',
+                    acquisition_datetime text'''
+Create_Table = r"create table if not exists BandAssessments(" + Table_Columns + ");"
+# the indexes of the columns used by QueryHandler
+Create_Indexes = (
+    r"create index if not exists BandAssessments_Serial on BandAssessments(serial_number, acquisition_datetime);",
+    r"create index if not exists BandAssessments_Kernel on BandAssessments(kernel, slice_mode, kvp);",
+    r"create index if not exists BandAssessments_DateTime on BandAssessments(acquisition_datetime);",
+    r"create index if not exists BandAssessments_Modality on BandAssessments(modality);",
+    r"create index if not exists BandAssessments_Collimation on BandAssessments(total_collimation);",
+)
+Insert_Data = r"insert into BandAssessments values (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?);"
+# the statistics of the integration results per scanner, protocol and time bucket.
+# sum, sum_square and max_abs are little-endian float64 blobs with one value per radius.
+Create_Trend_Table = '''create table if not exists BandTrends(
+                            serial_number integer,
+                            kernel text,
+                            total_collimation real,
+                            kvp real,
+                            bucket text,
+                            profile_length integer,
+                            count integer,
+                            sum blob,
+                            sum_square blob,
+                            max_abs blob);'''
+Create_Trend_Index = r"create unique index if not exists BandTrends_Key on BandTrends(" \
+                     r"serial_number, kernel, total_collimation, kvp, bucket, profile_length);"
+Trend_Dtype = "<f8"
+# the number of leading characters of acquisition_datetime used as time bucket, 6 is one month
+Trend_Bucket = 6
+# the separator of the integration result in schema 0
+Integration_Split = ','
+
+
+def encode_profile(profile):
+    """
+    :param profile: the integration result as list or np array
+    :return: a tuple as (blob, dtype, length) to store
+    """
+    profile = np.ascontiguousarray(profile, dtype=Profile_Dtype)
+    return profile.tobytes(), Profile_Dtype, len(profile)
+
+
+def decode_profile(blob, dtype=Profile_Dtype, length=None):
+    """
+    :param blob: the stored integration result
+    :param dtype: the stored profile_dtype
+    :param length: the stored profile_length, None to use the whole blob
+    :return: a read only np array on the blob, it is not copied
+    """
+    return np.frombuffer(blob, dtype=np.dtype(dtype), count=-1 if length is None else length)
+
+
+def record_values(dicom_image):
+    """
+    The values of one BandAssessments row.
+    :param dicom_image: an ImageHandler or ImageRecord
+    :return: a tuple in the column order of BandAssessments
+    """
+    return (dicom_image.Uid,
+            dicom_image.Modality,
+            dicom_image.SerialNumber,
+            dicom_image.KVP,
+            dicom_image.Current,
+            dicom_image.Kernel,
+            dicom_image.TotalCollimation,
+            dicom_image.SliceThickness,
+            str(dicom_image.TotalSlice) + "x" + str(dicom_image.SliceThickness),
+            dicom_image.Instance) + \
+        encode_profile(dicom_image.Image_Median_Filter_Result) + \
+        ("n.a.",
+         str(dicom_image.DateTime) if dicom_image.DateTime is not None else None)
+
+
+def new_rows(con, rows):
+    """
+    Remove the rows whose uid is already stored or repeated.
+    :param con: sqlite3 connection
+    :param rows: a list of record_values
+    :return: a list of the new rows
+    """
+    uids = [row[0] for row in rows]
+    stored = set()
+    # stay below the max number of sql variables
+    for start in range(0, len(uids), 500):
+        chunk = uids[start:start + 500]
+        stored.update(uid for uid, in con.execute(
+            r"select uid from BandAssessments where uid in (" + ",".join("?" * len(chunk)) + ");",
+            chunk))
+    result = []
+    for row in rows:
+        if row[0] not in stored:
+            stored.add(row[0])
+            result.append(row)
+    return result
+
+
+def replace_rows(con, rows):
+    """
+    Delete the stored rows with the uid of rows, so rows can be inserted instead.
+    :param con: sqlite3 connection
+    :param rows: a list of record_values
+    :return: a set of the trend_key of the deleted rows, see rebuild_trends
+    """
+    uids = [row[0] for row in rows]
+    keys = set()
+    # stay below the max number of sql variables
+    for start in range(0, len(uids), 500):
+        chunk = uids[start:start + 500]
+        where = r" from BandAssessments where uid in (" + ",".join("?" * len(chunk)) + ");"
+        keys.update(trend_key(row) for row in con.execute(r"select *" + where, chunk))
+        con.execute(r"delete" + where, chunk)
+    return keys
+
+
+def trend_key(row):
+    """
+    :param row: record_values of an image
+    :return: the key of the BandTrends row it belongs to, as
+    (serial number, kernel, total collimation, kvp, bucket, profile length)
+    """
+    acquisition_datetime = row[14]
+    bucket = acquisition_datetime[:Trend_Bucket] if acquisition_datetime else ""
+    return row[2], row[5], row[6], row[3], bucket, row[12]
+
+
+def update_trends(con, rows):
+    """
+    Add newly inserted images to BandTrends. Call it in the transaction of the insert.
+    :param con: sqlite3 connection
+    :param rows: a list of record_values, which are inserted
+    :return: no return
+    """
+    groups = {}
+    for row in rows:
+        groups.setdefault(trend_key(row), []).append(decode_profile(row[10], row[11], row[12]))
+    for key, profiles in groups.items():
+        stack = np.vstack(profiles).astype(np.float64)
+        count = stack.shape[0]
+        total = stack.sum(axis=0)
+        square = np.square(stack).sum(axis=0)
+        max_abs = np.abs(stack).max(axis=0)
+        # "is" also matches missing values
+        old = con.execute(r"select rowid, count, sum, sum_square, max_abs from BandTrends "
+                          r"where serial_number is ? and kernel is ? and total_collimation is ? "
+                          r"and kvp is ? and bucket is ? and profile_length is ?;", key).fetchone()
+        if old is None:
+            con.execute(r"insert into BandTrends values (?,?,?,?,?,?,?,?,?,?);",
+                        key + (count,
+                               total.astype(Trend_Dtype).tobytes(),
+                               square.astype(Trend_Dtype).tobytes(),
+                               max_abs.astype(Trend_Dtype).tobytes()))
+            continue
+        count += old[1]
+        total += np.frombuffer(old[2], dtype=Trend_Dtype)
+        square += np.frombuffer(old[3], dtype=Trend_Dtype)
+        max_abs = np.fmax(max_abs, np.frombuffer(old[4], dtype=Trend_Dtype))
+        con.execute(r"update BandTrends set count = ?, sum = ?, sum_square = ?, max_abs = ? "
+                    r"where rowid = ?;",
+                    (count,
+                     total.astype(Trend_Dtype).tobytes(),
+                     square.astype(Trend_Dtype).tobytes(),
+                     max_abs.astype(Trend_Dtype).tobytes(),
+                     old[0]))
+
+
+def rebuild_trends(con, keys):
+    """
+    Calculate BandTrends rows again from the stored images, e.g. after images are
+    replaced. max_abs can not be taken back, so the rows are not updated incrementally.
+    Call it in the transaction of the change.
+    :param con: sqlite3 connection
+    :param keys: a list of trend_key
+    :return: no return
+    """
+    for key in keys:
+        con.execute(r"delete from BandTrends "
+                    r"where serial_number is ? and kernel is ? and total_collimation is ? "
+                    r"and kvp is ? and bucket is ? and profile_length is ?;", key)
+        rows = con.execute(r"select * from BandAssessments "
+                           r"where serial_number is ? and kernel is ? and total_collimation is ? "
+                           r"and kvp is ? and coalesce(substr(acquisition_datetime, 1, ?), '') = ? "
+                           r"and profile_length is ?;",
+                           key[:4] + (Trend_Bucket,) + key[4:]).fetchall()
+        if rows:
+            update_trends(con, rows)
+
+
+def schema_version(con):
+    """
+    :param con: sqlite3 connection
+    :return: the schema version of the database
+    """
+    return con.execute(r"pragma user_version;").fetchone()[0]
+
+
+def prepare_database(con):
+    """
+    Create the table in a new database, or check the schema version of an existing one.
+    :param con: sqlite3 connection
+    :return: True if the database can be used, False if it needs migrateDatabase.py
+    """
+    exists = con.execute(r"select count(*) from sqlite_master "
+                         r"where type = 'table' and name = 'BandAssessments';").fetchone()[0]
+    if not exists:
+        con.execute(Create_Table)
+        for sql_string in Create_Indexes:
+            con.execute(sql_string)
+        con.execute(Create_Trend_Table)
+        con.execute(Create_Trend_Index)
+        con.execute(r"pragma user_version = " + str(Schema_Version) + ";")
+        return True
+    version = schema_version(con)
+    if version != Schema_Version:
+        logging.error(r"Database schema version is " + str(version) + " instead of " +
+                      str(Schema_Version) + ". Please run migrateDatabase.py.")
+        return False
+    return True
+
+
+def _migrate_text_profiles(con):
+    """
+    Schema 0 to 1: convert the comma separated text to float32 blob.
+    """
+    con.execute(r"create table BandAssessments_1(" + Table_Columns_1 + ");")
+    rows = con.execute(r"select uid, modality, serial_number, kvp, current, kernel, "
+                       r"total_collimation, slice_thickness, slice_mode, instance, "
+                       r"integration_result, comment from BandAssessments;")
+
+    def convert(row):
+        text = row[10]
+        profile = np.array(text.split(Integration_Split), dtype=np.float64) if text else []
+        return row[:10] + encode_profile(profile) + row[11:]
+
+    con.executemany(r"insert into BandAssessments_1 values (?,?,?,?,?,?,?,?,?,?,?,?,?,?);",
+                    (convert(row) for row in rows))
+    con.execute(r"drop table BandAssessments;")
+    con.execute(r"alter table BandAssessments_1 rename to BandAssessments;")
+
+
+def uid_date_time(uid, instance):
+    """
+    Take the acquisition date time back from a uid, which is
+    str(serial number) + date time + str(instance), see DicomHandler.Uid.
+    The stored serial_number can not be used to cut the uid, it is empty for old rows
+    and an integer column drops the leading zeros. So the date time is found from its
+    format: 14 digits YYYYMMDDHHMMSS, with an optional ".ffffff" fraction.
+    :param uid: the stored uid
+    :param instance: the stored instance
+    :return: the dicom date time string, or None if it is not found
+    """
+    if uid is None:
+        return None
+    rest = str(uid)
+    suffix = str(instance)
+    if rest.endswith(suffix):
+        rest = rest[:len(rest) - len(suffix)]
+    dot = rest.rfind(".")
+    start = (dot if dot >= 0 else len(rest)) - 14
+    if start < 0 or not rest[start:start + 14].isdigit():
+        return None
+    return rest[start:]
+
+
+def _migrate_acquisition_datetime(con):
+    """
+    Schema 1 to 2: add acquisition_datetime, taken back from the uid
+    which is serial number + date time + instance, and create the indexes.
+    """
+    con.execute(r"alter table BandAssessments add column acquisition_datetime text;")
+    rows = con.execute(r"select rowid, uid, instance from BandAssessments;").fetchall()
+    con.executemany(r"update BandAssessments set acquisition_datetime = ? where rowid = ?;",
+                    ((uid_date_time(uid, instance), rowid) for rowid, uid, instance in rows))
+    for sql_string in Create_Indexes:
+        con.execute(sql_string)
+
+
+def _migrate_trends(con):
+    """
+    Schema 2 to 3: create BandTrends from all stored images.
+    """
+    con.execute(Create_Trend_Table)
+    con.execute(Create_Trend_Index)
+    cursor = con.execute(r"select * from BandAssessments;")
+    while True:
+        rows = cursor.fetchmany(10000)
+        if not rows:
+            break
+        update_trends(con, rows)
+
+
+# {schema version: function to migrate it to the next version}
+Migrations = {0: _migrate_text_profiles,
+              1: _migrate_acquisition_datetime,
+              2: _migrate_trends}
+
+
+def migrate_database(database_name):
+    """
+    Migrate an existing database to Schema_Version in one transaction.
+    :param database_name: the sqlite3 database file
+    :return: True if the database is at Schema_Version
+    """
+    try:
+        con = sqlite3.connect(database_name, isolation_level=None)
+    except sqlite3.Error as e:
+        logging.error(str(e))
+        return False
+    try:
+        version = schema_version(con)
+        con.execute(r"begin;")
+        while version < Schema_Version:
+            Migrations[version](con)
+            version += 1
+            con.execute(r"pragma user_version = " + str(version) + ";")
+            logging.info(r"Database migrated to schema version " + str(version) + ".")
+        con.execute(r"commit;")
+    except sqlite3.Error as e:
+        logging.error(str(e))
+        if con.in_transaction:
+            con.execute(r"rollback;")
+        con.close()
+        return False
+    con.close()
+    return version == Schema_Version
+
+
 class SQL3Handler:
     """
     Create a Sqlite3 handler to store the data.
-    for the integration result, it will be converted to string and then store into database.
-    So when extracting data, the string should be converted back to list or numpy array before doing calculation
+    for the integration result, it is stored as little-endian float32 blob.
+    See encode_profile and decode_profile.
     """
-    Integration_Split = ','
+    Integration_Split = Integration_Split
     Database_Name = "BandAssessment.sqlite3.db"
 
     def __init__(self, dicom_image: ImageHandler):
@@ -22,57 +372,52 @@ class SQL3Handler:
             logging.debug(str(e))
             return
         logging.debug(r"Database connected")
-        sql_cursor = con.cursor()
-        sql_string = '''create table BandAssessments(
-                           uid text primary key,
-                           modality text,
-                           serial_number integer,
-                           kvp real,
-                           current integer,
-                           kernel text,
-                           total_collimation real,
-                           slice_thickness real,
-                           slice_mode text,
-                           instance integer,
-                           integration_result text,
-                           comment text);'''
         try:
-            sql_cursor.execute(sql_string)
+            if not prepare_database(con):
+                con.close()
+                return
         except sqlite3.Error as e:
             logging.debug(str(e))
             return
         logging.debug(r"create table done.")
         con.close()
 
+    @classmethod
+    def stored_uids(cls, database_name=None):
+        """
+        Read the uid of all stored images, to skip them before they are analyzed.
+        :param database_name: the sqlite3 database file. Default is Database_Name
+        :return: a set of uid, empty if the database or table does not exist yet
+        """
+        if database_name is None:
+            database_name = cls.Database_Name
+        try:
+            con = sqlite3.connect(database_name)
+        except sqlite3.Error as e:
+            logging.debug(str(e))
+            return set()
+        try:
+            uids = {row[0] for row in con.execute(r"select uid from BandAssessments;")}
+        except sqlite3.Error as e:
+            logging.debug(str(e))
+            uids = set()
+        con.close()
+        return uids
+
     def insert_data(self):
         try:
             con = sqlite3.connect(self.Database_Name)
         except sqlite3.Error as e:
             logging.debug(str(e))
             return
-        # convert numpy into string to store in sqlite3
-        integration_result = []
-        for x in self.DicomImage.Image_Median_Filter_Result:
-            integration_result.append(str(x))
-        int_result_string = self.Integration_Split.join(integration_result)
         # set up for store in sql
         sql_cursor = con.cursor()
-        sql_string = r"insert into BandAssessments values (?,?,?,?,?,?,?,?,?,?,?,?);"
+        sql_string = Insert_Data
         try:
             logging.debug(str(self.DicomImage.Uid))
-            sql_cursor.execute(sql_string,
-                               (self.DicomImage.Uid,
-                                self.DicomImage.Modality,
-                                self.DicomImage.SerialNumber,
-                                self.DicomImage.KVP,
-                                self.DicomImage.Current,
-                                self.DicomImage.Kernel,
-                                self.DicomImage.TotalCollimation,
-                                self.DicomImage.SliceThickness,
-                                str(self.DicomImage.TotalSlice) + "x" + str(self.DicomImage.SliceThickness),
-                                self.DicomImage.Instance,
-                                int_result_string,
-                                "n.a."))
+            row = record_values(self.DicomImage)
+            sql_cursor.execute(sql_string, row)
+            update_trends(con, [row])
         except sqlite3.Error as e:
             logging.error(str(e))
             con.close()
@@ -81,23 +426,128 @@ class SQL3Handler:
         logging.info(r"Insert record done.")
         con.close()
 
-    def read_data(self):
+    def read_data(self, uid=None):
+        """
+        Read a stored integration result.
+        :param uid: uid of the image, None for the uid of self.DicomImage
+        :return: read only np array, or None if it is not found
+        """
+        if uid is None:
+            uid = self.DicomImage.Uid
         try:
             con = sqlite3.connect(self.Database_Name)
         except sqlite3.Error as e:
             logging.debug(str(e))
             return
         sql_cursor = con.cursor()
-        sql_string = r"select integration_result from BandAssessment"
-        sql_cursor.execute(sql_string)
-        data = sql_cursor.fetchone()[0]
-        str_result = data.split(self.Integration_Split)
-        float_result = []
-        for x in str_result:
-            float_result.append(float(x))
-        np_result = np.array(float_result)
-        print(type(np_result))
-        print(np_result)
+        sql_string = r"select integration_result, profile_dtype, profile_length " \
+                     r"from BandAssessments where uid = ?;"
+        try:
+            data = sql_cursor.execute(sql_string, (uid,)).fetchone()
+        except sqlite3.Error as e:
+            logging.error(str(e))
+            con.close()
+            return
         con.close()
+        if data is None:
+            return None
+        return decode_profile(*data)
         # End of class SQL3Handler:
         ##############################################################
+
+
+class SQL3Writer:
+    """
+    Store many images with one connection.
+    The rows are collected and inserted by executemany in one transaction per batch,
+    BandTrends is updated in the same transaction.
+    An image whose uid is already stored is ignored, so a run can be repeated,
+    or it replaces the stored one in replace mode.
+    Use it as context manager, or call close at the end to store the last rows.
+    """
+    Database_Name = SQL3Handler.Database_Name
+
+    def __init__(self, database_name=None, batch_size=500, replace=False):
+        """
+        :param database_name: the sqlite3 database file. Default is Database_Name
+        :param batch_size: the number of rows stored in one transaction
+        :param replace: replace the stored images with the same uid, and their BandTrends
+        """
+        self.isComplete = False
+        if database_name is not None:
+            self.Database_Name = database_name
+        self.BatchSize = max(1, batch_size)
+        self.Replace = replace
+        self.Rows = []
+        self.Inserted = 0
+        try:
+            # transactions are started explicitly in flush
+            self.Connection = sqlite3.connect(self.Database_Name, isolation_level=None)
+            self.Connection.execute(r"pragma journal_mode=wal;")
+            # with wal, normal sync is safe against corruption and avoids an fsync per commit
+            self.Connection.execute(r"pragma synchronous=normal;")
+            if not prepare_database(self.Connection):
+                self.Connection.close()
+                return
+        except sqlite3.Error as e:
+            logging.error(str(e))
+            return
+        self.isComplete = True
+        logging.debug(r"Database " + self.Database_Name + " opened for writing.")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def add(self, dicom_image):
+        """
+        Collect one image, the batch is stored when it is full.
+        :param dicom_image: an ImageHandler or ImageRecord
+        :return: the result of flush if the batch is stored, else 0
+        """
+        self.Rows.append(record_values(dicom_image))
+        if len(self.Rows) >= self.BatchSize:
+            return self.flush()
+        return 0
+
+    def flush(self):
+        """
+        Store the collected rows in one transaction.
+        :return: the number of inserted rows, the rows of stored uids are not counted
+        unless they are replaced. None if the transaction failed, nothing is stored then.
+        """
+        if not self.Rows:
+            return 0
+        rows, self.Rows = self.Rows, []
+        try:
+            self.Connection.execute(r"begin;")
+            if self.Replace:
+                # the last row of a repeated uid is kept
+                inserted_rows = list({row[0]: row for row in rows}.values())
+                replaced_keys = replace_rows(self.Connection, inserted_rows)
+            else:
+                inserted_rows = new_rows(self.Connection, rows)
+                replaced_keys = set()
+            self.Connection.executemany(Insert_Data, inserted_rows)
+            update_trends(self.Connection,
+                          [row for row in inserted_rows if trend_key(row) not in replaced_keys])
+            rebuild_trends(self.Connection, replaced_keys)
+            self.Connection.execute(r"commit;")
+            inserted = len(inserted_rows)
+        except sqlite3.Error as e:
+            logging.error(str(e))
+            if self.Connection.in_transaction:
+                self.Connection.execute(r"rollback;")
+            return None
+        self.Inserted += inserted
+        logging.info(r"Insert " + str(inserted) + " of " + str(len(rows)) + " records done.")
+        return inserted
+
+    def close(self):
+        if not self.isComplete:
+            return
+        self.flush()
+        self.Connection.close()
+        self.isComplete = False
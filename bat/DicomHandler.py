@@ -1,15 +1,120 @@
+import io
 import pydicom as dicom
+from pydicom.filereader import data_element_generator
 import numpy as np
 import logging
 
 
+# a dicom file starts with 128 bytes preamble and "DICM"
+Dicom_Preamble_Length = 128
+Dicom_Prefix = b"DICM"
+# the header fields used to select files before the pixel data is read
+Header_Tags = {
+    "SerialNumber": (0x0018, 0x1000),
+    "Modality": (0x0008, 0x1090),
+    "StudyDescription": (0x0008, 0x1030),
+    "KVP": (0x0018, 0x0060),
+    "Kernel": (0x0018, 0x1210),
+    "Series": (0x0020, 0x0011),
+    "Instance": (0x0020, 0x0013),
+    "TotalCollimation": (0x0018, 0x9307),
+    "OriginalCollimation": (0x0029, 0x102c),
+    "SliceThickness": (0x0018, 0x0050),
+    "DateTime": (0x0008, 0x002a),
+}
+
+
+def is_dicom_file(filename):
+    """
+    Cheap check if the file has the "DICM" prefix after the preamble.
+    :param filename: file name including path
+    :return: True if it looks like a dicom file
+    """
+    try:
+        with open(filename, 'rb') as fp:
+            fp.seek(Dicom_Preamble_Length)
+            return fp.read(len(Dicom_Prefix)) == Dicom_Prefix
+    except OSError as e:
+        logging.error(str(e))
+        return False
+
+
+def plain_value(value):
+    """
+    Convert a pydicom value to a plain python value.
+    :param value: value of a data element
+    :return: int, float, str, list or None
+    """
+    if value is None or isinstance(value, bool):
+        return value
+    if isinstance(value, int):
+        return int(value)
+    if isinstance(value, float):
+        return float(value)
+    if isinstance(value, bytes):
+        return value.decode("ascii", "replace").strip()
+    if isinstance(value, (list, tuple)):
+        return [plain_value(v) for v in value]
+    return str(value)
+
+
+def read_header(filename):
+    """
+    Read the dicom header only, stop before the pixel data.
+    :param filename: file name including path
+    :return: a dict of the Header_Tags fields (None if missing) and "Uid",
+    or None if the file is not a readable dicom file.
+    """
+    if not is_dicom_file(filename):
+        return None
+    try:
+        data = dicom.read_file(filename, stop_before_pixels=True)
+        if Header_Tags["SerialNumber"] not in data:
+            logging.info(str(filename) + " has no serial number.")
+            return None
+        header = {}
+        for name, tag in Header_Tags.items():
+            header[name] = data[tag].value if tag in data else None
+        # same as DicomHandler.Uid
+        header["Uid"] = str(header["SerialNumber"]) + str(header["DateTime"]) + str(header["Instance"])
+    except Exception as e:
+        logging.error(str(filename) + ": " + str(e))
+        return None
+    return {name: plain_value(value) for name, value in header.items()}
+
+
+def split_pixel_data(data):
+    """
+    Split the content of a dicom file into the header and the decoded pixel data.
+    :param data: the content of the dicom file as bytes
+    :return: a tuple as (header bytes without the pixel data, np array of the pixel data)
+    """
+    fp = io.BytesIO(data)
+    dataset = dicom.read_file(fp, stop_before_pixels=True)
+    # the reader stops just before the pixel data element
+    header = data[:fp.tell()]
+    # read the pixel data element only, the parsed header is not read again
+    element = next(data_element_generator(fp, dataset.is_implicit_VR, dataset.is_little_endian))
+    dataset.PixelData = element.value
+    return header, dataset.pixel_array
+
+
 class DicomHandler:
-    def __init__(self, filename):
+    def __init__(self, filename, data=None, pixels=None):
+        """
+        :param filename: input dicom file name including path
+        :param data: the content of the dicom file as bytes if it is already read
+        :param pixels: the decoded pixel data as np array, see split_pixel_data.
+        data is then the header only. The array is used without copy.
+        """
         self.isComplete = False
         self.FileName = filename
 
         try:
-            self.Data = dicom.read_file(self.FileName)
+            if data is None:
+                self.Data = dicom.read_file(self.FileName)
+            else:
+                self.Data = dicom.read_file(io.BytesIO(data))
 
             # system related
             self.SerialNumber = self.Data[0x0018, 0x1000].value
@@ -34,7 +139,10 @@ class DicomHandler:
             self.Window = (self.Data[0x0028, 0x1051].value,    # window width
                            self.Data[0x0028, 0x1050].value)    # window center
             self.FOV = self.Data[0x0018, 0x1100].value
-            self.RawData = np.array(self.Data.pixel_array)
+            if pixels is None:
+                self.RawData = np.array(self.Data.pixel_array)
+            else:
+                self.RawData = pixels
 
             # Scan related
             self.KVP = self.Data[0x0018, 0x0060].value
@@ -64,6 +172,17 @@ class DicomHandler:
         self.isComplete = True
         logging.info(r"Dicom " + str(self.FileName) + " initialed OK.")
 
+    def release_pixel_data(self):
+        """
+        Drop the pixel data of the dicom dataset after it is decoded.
+        :return: no return
+        """
+        if 'PixelData' in self.Data:
+            del self.Data.PixelData
+        # pydicom also keeps the decoded array in the dataset
+        if getattr(self.Data, "_pixel_array", None) is not None:
+            self.Data._pixel_array = None
+
 
 if __name__ == '__main__':
     print("please do not use it individually unless of debugging.")
@@ -1,50 +1,199 @@
 #!coding=utf8
 import os
-import pydicom
+import fnmatch
 import logging
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import FIRST_COMPLETED
+from concurrent.futures import wait
+from bat.DicomHandler import read_header
+from bat.IndexHandler import ScanIndexHandler
 
 
 class DirectoryHandler:
     """
     The class will iterate the input directory to find target database file.
-    And store each found file full path in a list of string "Database_File_Path"
+    And store each found file full path in a list of string "Dicom_File_Path"
+    Only the dicom header is read. The header fields of each found file are stored
+    in the dict "Dicom_File_Index" as {path: header}, see DicomHandler.read_header
+    The files can also be consumed by iter_files as soon as they are found.
     """
-    Dicom_File_Path = []
-    Total_Dicom_Quantity = 0
 
-    def __init__(self, input_directory):
+    def __init__(self, input_directory, study_description=r"Band Assessment", index=None,
+                 include=None, exclude=None, max_depth=None, workers=8, scan=True,
+                 known_uids=None, resume=False):
         """
         :param input_directory:
+        :param study_description: only keep files with this study description.
+        None to keep all dicom files.
+        :param index: a ScanIndexHandler. Files with unchanged size and mtime are
+        taken from the index without being opened. None to read every file.
+        :param include: a list of file name patterns (fnmatch) to probe. None for all files.
+        :param exclude: a list of file or folder name patterns (fnmatch) to skip.
+        :param max_depth: the max folder depth to go into, 0 is the input folder only.
+        None for no limit.
+        :param workers: the number of threads to read the headers
+        :param scan: scan the whole folder now. If False, use iter_files to scan.
+        :param known_uids: a set of uid to skip, e.g. SQL3Handler.stored_uids().
+        The uid of each found file is added, so a copy of the same image is skipped too.
+        :param resume: skip the unchanged files which are done in the index
         """
+        self.Dicom_File_Path = []
+        self.Dicom_File_Index = {}
+        self.Total_Dicom_Quantity = 0
+        self.Skipped_Quantity = 0
+        self.KnownUids = known_uids
+        self.Resume = resume
+        self.StudyDescription = study_description
+        self.Index = index
+        self.Include = include
+        self.Exclude = exclude
+        self.MaxDepth = max_depth
+        self.Workers = workers
+        self.InputDirectory = None
         if input_directory is not None:
             if os.path.isdir(input_directory):
                 logging.info(r"Input is a folder.")
             else:
                 logging.error(r"input is not a folder. Procedure quited.")
                 return
-        absolute_path = os.path.abspath(input_directory)
-        self.list_files(absolute_path)
+        self.InputDirectory = os.path.abspath(input_directory)
+        if scan:
+            for _ in self.iter_files():
+                pass
 
-    def list_files(self, input_directory):
+    def iter_files(self):
         """
-        :param input_directory:
-        :return: no return. Directly write all target files found in Database_File_Path
+        Scan the input folder and yield each target file as soon as its header is validated.
+        The headers are read by a thread pool, so the order is not fixed.
+        Each yielded file is also recorded in Dicom_File_Path and Dicom_File_Index.
+        :return: a generator of (full path, header)
+        """
+        if self.InputDirectory is None:
+            return
+        with ThreadPoolExecutor(max_workers=self.Workers) as pool:
+            pending = set()
+            for full_path in self.walk():
+                pending.add(pool.submit(self.probe, full_path))
+                # keep the number of queued probes bounded
+                if len(pending) >= self.Workers * 4:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for item in self.__accept(done):
+                        yield item
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for item in self.__accept(done):
+                    yield item
+        if self.Index is not None:
+            self.Index.commit()
+
+    def __accept(self, done):
         """
-        dir_list = os.listdir(input_directory)
-        for dl in dir_list:
-            full_dl = os.path.join(input_directory, dl)
-            if os.path.isfile(full_dl):
+        Record the probed files which are target files.
+        :param done: the finished futures of probe
+        :return: a generator of (full path, header)
+        """
+        for future in done:
+            full_path, header, status = future.result()
+            if header is None:
+                logging.info(str(full_path) + " is not a dicom file.")
+                continue
+            if self.StudyDescription is not None and \
+               header["StudyDescription"] != self.StudyDescription:
+                logging.info(str(full_path) + " is not " + self.StudyDescription)
+                if self.Index is not None and status == ScanIndexHandler.Status_New:
+                    # a terminal status, so the file is not taken as pending work again
+                    self.Index.set_status(full_path, ScanIndexHandler.Status_Skipped)
+                continue
+            if self.Resume and status == ScanIndexHandler.Status_Done:
+                logging.info(str(full_path) + " is done in the index.")
+                self.Skipped_Quantity += 1
+                continue
+            if self.KnownUids is not None:
+                if header["Uid"] in self.KnownUids:
+                    logging.info(str(full_path) + " is already stored.")
+                    self.Skipped_Quantity += 1
+                    continue
+                self.KnownUids.add(header["Uid"])
+            self.Dicom_File_Path.append(full_path)
+            self.Dicom_File_Index[full_path] = header
+            self.Total_Dicom_Quantity += 1
+            logging.info(str(full_path))
+            yield full_path, header
+
+    def walk(self):
+        """
+        Walk through the input folder with os.scandir.
+        :return: a generator of the full path of each file matching the patterns
+        """
+        folders = [(self.InputDirectory, 0)]
+        while folders:
+            folder, depth = folders.pop()
+            try:
+                with os.scandir(folder) as it:
+                    entries = sorted(it, key=lambda e: e.name)
+            except OSError as e:
+                logging.error(str(e))
+                continue
+            sub_folders = []
+            for entry in entries:
+                if self.Exclude is not None and \
+                   any(fnmatch.fnmatch(entry.name, p) for p in self.Exclude):
+                    continue
                 try:
-                    # try to open the dicom file.
-                    _ = pydicom.read_file(full_dl)[0x0018, 0x1000].value
-                    self.Dicom_File_Path.append(full_dl)
-                    self.Total_Dicom_Quantity += 1
-                    logging.info(str(full_dl))
-                except Exception as e:
-                    logging.info(str(full_dl))
+                    is_file = entry.is_file()
+                except OSError as e:
                     logging.error(str(e))
-            else:
-                self.list_files(full_dl)
+                    continue
+                if is_file:
+                    if self.Include is None or \
+                       any(fnmatch.fnmatch(entry.name, p) for p in self.Include):
+                        yield entry.path
+                elif self.MaxDepth is None or depth < self.MaxDepth:
+                    sub_folders.append((entry.path, depth + 1))
+            # go into the sub folders in name order
+            folders.extend(reversed(sub_folders))
+
+    def probe(self, full_path):
+        """
+        Read the header of a file, it is called by the thread pool.
+        :param full_path: full file path
+        :return: a tuple as (full path, header, status), header is None for a non dicom file
+        """
+        try:
+            return (full_path,) + self.read_index(full_path)
+        except Exception as e:
+            logging.error(str(full_path) + ": " + str(e))
+            return full_path, None, None
+
+    def read_header(self, full_path):
+        """
+        Read the header of a file from the index, or from the file if it is new or changed.
+        :param full_path: full file path
+        :return: the header dict, or None for a non dicom file
+        """
+        return self.read_index(full_path)[0]
+
+    def read_index(self, full_path):
+        """
+        Read the header and processing status of a file from the index,
+        or from the file if it is new or changed.
+        :param full_path: full file path
+        :return: a tuple as (header, status). status is None without index.
+        """
+        if self.Index is None:
+            # read the header only, the pixel data is not touched
+            return read_header(full_path), None
+        stat = os.stat(full_path)
+        record = self.Index.lookup(full_path, stat)
+        if record is not None:
+            return record
+        header = read_header(full_path)
+        if header is None:
+            status = ScanIndexHandler.Status_Rejected
+        else:
+            status = ScanIndexHandler.Status_New
+        self.Index.update(full_path, header, status, stat)
+        return header, status
 
 
 if __name__ == '__main__':
@@ -0,0 +1,223 @@
+import io
+import os
+import logging
+import numpy as np
+from numpy.lib import format as npy
+from bat.QueryHandler import QueryHandler
+
+
+class ExportHandler:
+    """
+    Export the stored integration results to .npy files for offline analysis:
+        profiles.npy: float32 matrix with shape (records, radius), padded with NaN
+        metadata.npy: structured array with one element per record, see Metadata_Dtype.
+        The text fields are widened to the longest value in the database.
+    Both files can be opened without sqlite by np.load(..., mmap_mode='r').
+    In append mode only the records which are not exported yet are added at the end.
+    """
+    Profiles_Name = "profiles.npy"
+    Metadata_Name = "metadata.npy"
+    Metadata_Dtype = np.dtype([("uid", "U64"),
+                               ("modality", "U64"),
+                               ("serial_number", "<i8"),
+                               ("kvp", "<f8"),
+                               ("current", "<i8"),
+                               ("kernel", "U16"),
+                               ("total_collimation", "<f8"),
+                               ("slice_thickness", "<f8"),
+                               ("slice_mode", "U16"),
+                               ("instance", "<i8"),
+                               ("acquisition_datetime", "U32"),
+                               ("profile_length", "<i4")])
+
+    def __init__(self, output_directory, database_name=None, chunk_size=10000):
+        """
+        :param output_directory: the folder of profiles.npy and metadata.npy
+        :param database_name: the sqlite3 database file. Default is QueryHandler.Database_Name
+        :param chunk_size: the number of records read and written at once
+        """
+        self.OutputDirectory = output_directory
+        self.ChunkSize = chunk_size
+        self.ProfilesFile = os.path.join(output_directory, self.Profiles_Name)
+        self.MetadataFile = os.path.join(output_directory, self.Metadata_Name)
+        self.Query = QueryHandler(database_name)
+
+    def export(self, append=False, **filters):
+        """
+        :param append: add the new records to the existing files, else write them again
+        :param filters: see QueryHandler.where
+        :return: the number of exported records, None if failed
+        """
+        if not self.Query.isComplete:
+            return None
+        os.makedirs(self.OutputDirectory, exist_ok=True)
+        try:
+            if append and os.path.exists(self.ProfilesFile) and os.path.exists(self.MetadataFile):
+                return self.__append(filters)
+            return self.__write(filters)
+        except (OSError, ValueError) as e:
+            logging.error(str(e))
+            return None
+
+    def __write(self, filters):
+        """
+        Write both files again. They are written to temporary files first,
+        so the old files stay valid if anything goes wrong.
+        """
+        count = self.Query.count(**filters)
+        sql_string, parameters = self.Query.where(**filters)
+        width = self.Query.Connection.execute(
+            r"select max(profile_length) from BandAssessments" + sql_string + ";",
+            parameters).fetchone()[0] or 0
+        dtype = self.__metadata_dtype(sql_string, parameters)
+        profiles_temp = self.ProfilesFile + ".tmp"
+        metadata_temp = self.MetadataFile + ".tmp"
+        profiles = npy.open_memmap(profiles_temp, mode="w+", dtype=np.float32, shape=(count, width))
+        metadata = npy.open_memmap(metadata_temp, mode="w+", dtype=dtype, shape=(count,))
+        row = 0
+        for chunk_metadata, chunk_profiles in self.Query.iter_chunks(self.ChunkSize, **filters):
+            size = chunk_profiles.shape[0]
+            profiles[row:row + size] = self.__pad(chunk_profiles, width)
+            metadata[row:row + size] = self.__metadata(chunk_metadata, chunk_profiles, dtype)
+            row += size
+        profiles.flush()
+        metadata.flush()
+        del profiles, metadata
+        os.replace(profiles_temp, self.ProfilesFile)
+        os.replace(metadata_temp, self.MetadataFile)
+        logging.info(str(count) + r" records exported to " + self.OutputDirectory)
+        return count
+
+    def __append(self, filters):
+        """
+        Add the records which are not in metadata.npy to the end of both files.
+        The data is appended first, then the array headers are updated in place.
+        The dtype of metadata.npy is kept, longer text values are truncated with a warning.
+        """
+        exported = np.load(self.MetadataFile, mmap_mode="r")
+        dtype = exported.dtype
+        width = np.load(self.ProfilesFile, mmap_mode="r").shape[1]
+        exported_uids = set(exported["uid"].tolist())
+        del exported
+        count = 0
+        with open(self.ProfilesFile, "r+b") as profiles_file, \
+                open(self.MetadataFile, "r+b") as metadata_file:
+            profiles_rows = self.__data_end(profiles_file)
+            metadata_rows = self.__data_end(metadata_file)
+            if profiles_rows != metadata_rows:
+                raise ValueError(r"profiles.npy and metadata.npy have different records.")
+            for chunk_metadata, chunk_profiles in self.Query.iter_chunks(self.ChunkSize, **filters):
+                new = np.array([uid not in exported_uids for uid in chunk_metadata["uid"]], dtype=bool)
+                if not new.any():
+                    continue
+                if chunk_profiles.shape[1] > width and np.isfinite(chunk_profiles[new, width:]).any():
+                    raise ValueError(r"New integration results are longer than the exported " +
+                                     str(width) + " radius, please export again without append.")
+                chunk_metadata = {name: values[new] for name, values in chunk_metadata.items()}
+                chunk_profiles = chunk_profiles[new]
+                profiles_file.write(self.__pad(chunk_profiles, width).tobytes())
+                metadata_file.write(self.__metadata(chunk_metadata, chunk_profiles, dtype).tobytes())
+                count += chunk_profiles.shape[0]
+            self.__write_header(profiles_file, np.dtype(np.float32), (profiles_rows + count, width))
+            self.__write_header(metadata_file, dtype, (metadata_rows + count,))
+        logging.info(str(count) + r" records appended to " + self.OutputDirectory)
+        return count
+
+    @staticmethod
+    def __data_end(file):
+        """
+        Read the npy header and go to the end of the data.
+        Data left behind by an interrupted append is cut off.
+        :param file: the npy file opened as "r+b"
+        :return: the number of rows in the file
+        """
+        version = npy.read_magic(file)
+        if version == (1, 0):
+            shape, _, dtype = npy.read_array_header_1_0(file)
+        else:
+            shape, _, dtype = npy.read_array_header_2_0(file)
+        data_end = file.tell() + int(np.prod(shape)) * dtype.itemsize
+        file.truncate(data_end)
+        file.seek(data_end)
+        return shape[0]
+
+    @staticmethod
+    def __write_header(file, dtype, shape):
+        """
+        Write a new npy header with the new shape over the old one.
+        The header is padded to a fixed size, so it only grows if the shape gets many more digits.
+        """
+        header = {"descr": npy.dtype_to_descr(dtype), "fortran_order": False, "shape": shape}
+        new_header = io.BytesIO()
+        file.seek(0)
+        version = npy.read_magic(file)
+        if version == (1, 0):
+            npy.read_array_header_1_0(file)
+            npy.write_array_header_1_0(new_header, header)
+        else:
+            npy.read_array_header_2_0(file)
+            npy.write_array_header_2_0(new_header, header)
+        if new_header.tell() != file.tell():
+            raise ValueError(r"The npy header size changed, please export again without append.")
+        file.seek(0)
+        file.write(new_header.getvalue())
+
+    @staticmethod
+    def __pad(profiles, width):
+        """
+        :return: the profiles as float32 with width columns, padded with NaN
+        """
+        if profiles.shape[1] == width:
+            return profiles.astype(np.float32, copy=False)
+        result = np.full((profiles.shape[0], width), np.nan, dtype=np.float32)
+        size = min(width, profiles.shape[1])
+        result[:, :size] = profiles[:, :size]
+        return result
+
+    def __metadata_dtype(self, sql_string, parameters):
+        """
+        :return: Metadata_Dtype with each text field as long as its longest value in the records
+        """
+        fields = []
+        for name in self.Metadata_Dtype.names:
+            dtype = self.Metadata_Dtype[name]
+            if dtype.kind == "U":
+                longest = self.Query.Connection.execute(
+                    r"select max(length(" + name + r")) from BandAssessments" + sql_string + ";",
+                    parameters).fetchone()[0] or 0
+                dtype = np.dtype("U" + str(max(dtype.itemsize // 4, longest)))
+            fields.append((name, dtype))
+        return np.dtype(fields)
+
+    @staticmethod
+    def __metadata(metadata, profiles, dtype):
+        """
+        :param dtype: the dtype of metadata.npy, see Metadata_Dtype
+        :return: the metadata of a chunk as structured array
+        """
+        result = np.zeros(profiles.shape[0], dtype=dtype)
+        for name in dtype.names:
+            values = metadata[name]
+            kind = result.dtype[name].kind
+            if kind == "U":
+                values = [str(value) if value is not None else "" for value in values]
+                size = result.dtype[name].itemsize // 4
+                truncated = sum(len(value) > size for value in values)
+                if truncated:
+                    logging.warning(str(truncated) + r" " + name + r" values are longer than " +
+                                    str(size) + r" characters and are truncated, " +
+                                    r"please export again without append.")
+            elif values.dtype == object:
+                # missing numbers are stored as NaN or -1
+                values = [value if value is not None else (np.nan if kind == "f" else -1)
+                          for value in values]
+            result[name] = values
+        return result
+
+    def close(self):
+        if self.Query.isComplete:
+            self.Query.close()
+
+
+if __name__ == '__main__':
+    print("please do not use it individually unless of debugging.")
@@ -0,0 +1,119 @@
+import logging
+import threading
+import numpy as np
+from collections import OrderedDict
+
+
+class GeometryCache:
+    """
+    A process wide LRU cache of circle geometry (ring offsets, disk kernels and
+    ring label images). Nearly all images share the same matrix size and center,
+    so the geometry is built once and shared by all ImageHandler.
+    The cached np arrays are read only.
+    The memory is bounded by max_bytes, the least recently used entry is evicted first.
+    """
+
+    def __init__(self, max_bytes=64 * 1024 * 1024):
+        """
+        :param max_bytes: the max total size of cached arrays in bytes
+        """
+        self.MaxBytes = max_bytes
+        self.Hits = 0
+        self.Misses = 0
+        self.Evictions = 0
+        self.Bytes = 0
+        self.__entries = OrderedDict()
+        self.__lock = threading.Lock()
+
+    def get(self, kind: str, shape, center, radius, method, builder):
+        """
+        Get a geometry from cache, or build and store it when it is missing.
+        Pass None for a key part the geometry does not depend on.
+        :param kind: name of the geometry, e.g. "ring_offsets"
+        :param shape: the image shape as (rows, cols)
+        :param center: the circle center as (row, col)
+        :param radius: the radius in PIXEL
+        :param method: the method name, e.g. "bresenham"
+        :param builder: function without parameter to build the geometry,
+        returns a np array or a tuple of np arrays
+        :return: the cached geometry
+        """
+        key = (kind, shape, center, radius, method)
+        with self.__lock:
+            if key in self.__entries:
+                self.__entries.move_to_end(key)
+                self.Hits += 1
+                return self.__entries[key][0]
+        value = builder()
+        arrays = value if isinstance(value, tuple) else (value,)
+        size = 0
+        for array in arrays:
+            size += array.nbytes
+            # a view is locked together with the array it is taken from
+            while isinstance(array, np.ndarray):
+                array.flags.writeable = False
+                array = array.base
+        with self.__lock:
+            self.Misses += 1
+            if key not in self.__entries:
+                self.__entries[key] = (value, size)
+                self.Bytes += size
+            # keep at least the newest entry even if it is larger than MaxBytes
+            while self.Bytes > self.MaxBytes and len(self.__entries) > 1:
+                _, (_, evicted_size) = self.__entries.popitem(last=False)
+                self.Bytes -= evicted_size
+                self.Evictions += 1
+        return value
+
+    def stats(self):
+        """
+        :return: a dict of the cache counters
+        """
+        with self.__lock:
+            return {"hits": self.Hits,
+                    "misses": self.Misses,
+                    "evictions": self.Evictions,
+                    "entries": len(self.__entries),
+                    "bytes": self.Bytes}
+
+    def counters(self):
+        """
+        :return: a dict of the counters which can be summed over processes,
+        see add_counters
+        """
+        with self.__lock:
+            return {"hits": self.Hits,
+                    "misses": self.Misses,
+                    "evictions": self.Evictions}
+
+    def clear(self):
+        """
+        Remove all entries and reset the counters.
+        :return: no return
+        """
+        with self.__lock:
+            self.__entries.clear()
+            self.Hits = 0
+            self.Misses = 0
+            self.Evictions = 0
+            self.Bytes = 0
+        logging.debug(r"Geometry cache cleared.")
+
+
+def add_counters(total, counters):
+    """
+    Add the counters of one process or file to a total.
+    :param total: a dict as GeometryCache.counters, updated in place
+    :param counters: a dict as GeometryCache.counters
+    :return: no return
+    """
+    for name, value in counters.items():
+        total[name] = total.get(name, 0) + value
+
+
+# the cache shared by the whole process
+Geometry_Cache = GeometryCache()
+
+
+if __name__ == '__main__':
+    print("please do not use it individually unless of debugging.")
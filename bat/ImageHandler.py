@@ -1,12 +1,88 @@
 import logging
 import io
-import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
 import numpy as np
 from PIL import Image
-from PIL import ImageFilter
 from PIL import ImageDraw
-import math
+from collections import namedtuple
 from bat.DicomHandler import DicomHandler
+from bat.CircleGeometry import bresenham_offsets
+from bat.ImageMath import radial_profile
+from bat.ImageMath import roi_mean
+from bat.ImageMath import roi_mean_map
+from bat.ImageMath import find_phantom
+from bat.ImageMath import median_filter
+
+
+# result of ImageHandler.evaluate_iq
+# sorted_result: HU deviation of each perimeter ROI to min_hu, sorted by theta
+# theta: angle in degree of each perimeter ROI (counter-clockwise, 0 = right)
+IqResult = namedtuple("IqResult", ["sorted_result", "min_hu", "max_hu",
+                                   "min_pos", "max_dev_position",
+                                   "deviation", "max_deviation", "radius",
+                                   "theta"])
+
+
+def find_circle(image_hu, size: tuple, pix_space, detect_center=True):
+    """
+    Calculate the image center and radius
+    the method is simple
+    threshold the HU image and find the 1st/last pixel inside the phantom
+    on the center row and column, see ImageMath.find_phantom.
+    :param image_hu: the 2D HU image
+    :param size: the image size as (rows, cols)
+    :param pix_space: the pixel spacing as (row spacing, col spacing)
+    :param detect_center: the detected center will be used. If False, the matrix center
+    is used and the radius is always standardized, so the profile length stays
+    comparable with the stored results.
+    :return: return 3 tuples which are image center, radius and sub-pixel center
+    (center row, center col),(radius in pixel, radius in cm),(center row, center col)
+    """
+    max_allowed_deviation = 20
+    phantom = find_phantom(image_hu)
+    if phantom is None:
+        logging.warning(r"Phantom not found, use image center now!")
+        is_abnormal = True
+    else:
+        logging.debug(r"Center calculated as: " + str(phantom[:2]))
+        # if the calculated center deviated too much
+        is_abnormal = bool(abs(phantom[0] - size[0] / 2) > max_allowed_deviation or
+                           abs(phantom[1] - size[1] / 2) > max_allowed_deviation)
+        if is_abnormal:
+            logging.warning(r"It seems abnormal when calculate Center, use image center now!")
+
+    if is_abnormal is False:
+        center_sub_pixel = (phantom[0], phantom[1])
+        center_row = int(round(phantom[0]))
+        center_col = int(round(phantom[1]))
+    else:
+        center_row = size[0] // 2
+        center_col = size[1] // 2
+        center_sub_pixel = (float(center_row), float(center_col))
+
+    # set different radius according to normal/abnormal situation
+    if is_abnormal and detect_center:
+        logging.warning(r"Calculated center is abnormal, use 50 as radius!")
+        radius = 50
+        diameter_in_cm = radius * pix_space[0]
+    else:
+        # a phantom which is not found gives the small diameter as the old edge search did
+        radius = phantom[2] if phantom is not None else 0
+        diameter_in_cm = radius * pix_space[0] * 2
+        logging.debug(str(radius) + r"pix (radius), " + str(diameter_in_cm) +
+                      r"cm(diameter)<==Calculated phantom diameter")
+        # standardize the radius
+        if diameter_in_cm < 250:
+            radius = 233
+            logging.debug(str(radius) + r"pix" + r", which is: " +
+                          str(radius * pix_space[0] * 2) + r"cm <==Radius Readjusted")
+        else:
+            radius = 220
+            logging.debug(str(radius) + r"pix" + r", which is: " +
+                          str(radius * pix_space[0] * 2) + r"cm <==Radius Readjusted")
+
+    return (center_row, center_col), (radius, diameter_in_cm), center_sub_pixel
 
 
 class ImageHandler(DicomHandler):
@@ -17,15 +93,39 @@ class ImageHandler(DicomHandler):
     to deal with image related calculation.
     """
 
-    def __init__(self, filename, window=(50, 0)):
+    def __init__(self, filename, window=(50, 0), profile_method="bresenham",
+                 detect_center=False, median_width=8, median_tail="zero",
+                 lean=False, data=None, pixels=None):
         """
         Initialization function
         :param filename: input dicom file name including path
+        :param data: the content of the dicom file as bytes if it is already read.
+        filename is then only used to name the output files.
+        :param pixels: the decoded pixel data if data is the header only. See DicomHandler
+        :param profile_method: "bresenham" to stay comparable with stored
+        integration results, or "euclidean". See ImageMath.radial_profile
+        :param detect_center: use the detected phantom center for the calculation.
+        If False, the matrix center is used as the stored integration results do.
+        :param median_width: window width of the median filter
+        :param median_tail: "zero" or "shrink". See ImageMath.median_filter
+        :param lean: memory lean mode. ImageHU is kept as float32 only, the pixel data
+        of the dicom dataset is dropped, ImageRaw is windowed on each access and the
+        integration is calculated the first time its result is accessed.
         """
         self.isImageComplete = False
+        self.ProfileMethod = profile_method
+        self.DetectCenter = detect_center
+        self.MedianWidth = median_width
+        self.MedianTail = median_tail
+        self.Lean = lean
+        self.DisplayWindow = window
+        self.__image_raw = None
+        self.__integration_result = None
+        self.__median_filter_result = None
+        self.__iq_results = {}
         try:
             # call super to init DicomHandler class first
-            super(self.__class__, self).__init__(filename)
+            super(self.__class__, self).__init__(filename, data, pixels)
         except Exception as e:
             logging.error(str(e))
         if not self.isComplete:
@@ -34,18 +134,23 @@ class ImageHandler(DicomHandler):
 
         try:
             # Convert to HU unit
-            self.ImageHU = self.RawData * self.Slop + self.Intercept
-            self.ImageRaw = self.ImageHU.copy()
+            if self.Lean:
+                self.ImageHU = self.RawData.astype(np.float32)
+                self.ImageHU *= self.Slop
+                self.ImageHU += self.Intercept
+                self.RawData = None
+                self.release_pixel_data()
+            else:
+                self.ImageHU = self.RawData * self.Slop + self.Intercept
             self.rescale_image(window)
             # center is always in format (row, col)
             # Radius is always in format (radius in pixel, radius in cm)
             self.Center, self.Radius = self.calc_circle
-            self.Center = (256, 256)
-            # define circular integration result
-            self.Image_Integration_Result = np.zeros(self.Radius[0])
-            self.Image_Median_Filter_Result = np.zeros(self.Radius[0])
+            if not detect_center:
+                self.Center = (self.Size[0] // 2, self.Size[1] // 2)
             # main calculation
-            self.integration()
+            if not self.Lean:
+                self.integration()
         except Exception as e:
             logging.error(str(e))
             return
@@ -53,112 +158,92 @@ class ImageHandler(DicomHandler):
         self.isImageComplete = True
         logging.info(r"Image initialed OK.")
 
+    @property
+    def ImageRaw(self):
+        """
+        The image windowed by self.DisplayWindow and rescaled to 0~255.
+        In lean mode it is calculated again on each access.
+        """
+        if self.__image_raw is not None:
+            return self.__image_raw
+        image_raw = self.window_image(self.DisplayWindow)
+        if not self.Lean:
+            self.__image_raw = image_raw
+        return image_raw
+
+    @ImageRaw.setter
+    def ImageRaw(self, value):
+        self.__image_raw = value
+
+    @property
+    def Image_Integration_Result(self):
+        """
+        The mean HU value of each radius. Calculated on the first access.
+        """
+        if self.__integration_result is None:
+            self.integration()
+        return self.__integration_result
+
+    @Image_Integration_Result.setter
+    def Image_Integration_Result(self, value):
+        self.__integration_result = value
+
+    @property
+    def Image_Median_Filter_Result(self):
+        """
+        The median filtered integration result. Calculated on the first access.
+        """
+        if self.__median_filter_result is None:
+            self.integration()
+        return self.__median_filter_result
+
+    @Image_Median_Filter_Result.setter
+    def Image_Median_Filter_Result(self, value):
+        self.__median_filter_result = value
+
     def rescale_image(self, window: tuple):
         """
         rescale the image to set the data in range (0~255)
+        In lean mode only the window is stored, the image is rescaled when ImageRaw is accessed.
+        :param window: a tuple pass in as (window width, window center)
+        :return: no return. Directly write self.ImageRaw
+        """
+        self.DisplayWindow = window
+        self.__image_raw = None
+        if not self.Lean:
+            self.__image_raw = self.window_image(window)
+
+    def window_image(self, window: tuple):
+        """
+        Window the HU image and rescale it to 0~255.
         :param window: a tuple pass in as (window width, window center)
         :return: return a np array as rescaled image
         """
-        raw_data = self.ImageHU.copy()
         window_upper = window[1] + window[0] / 2
         window_lower = window[1] - window[0] / 2
-        # make filter according to center and width
-        upper_filter = raw_data > window_upper
-        raw_data[upper_filter] = window_upper  # set upper value
-        lower_filter = raw_data < window_lower
-        raw_data[lower_filter] = window_lower  # set lower value
+        # set upper and lower value, this is the only copy of the image
+        raw_data = np.clip(self.ImageHU, window_lower, window_upper)
         # rescale the data to 0~255
         min_hu_image = raw_data.min()
         max_hu_image = raw_data.max()
-        if min_hu_image == max_hu_image:
-            self.ImageRaw = (raw_data - min_hu_image) * 255
-        else:
+        raw_data -= min_hu_image
+        raw_data *= 255
+        if min_hu_image != max_hu_image:
             # rescale the image to fit 0~255
-            self.ImageRaw = (raw_data - min_hu_image) * 255 \
-                / (max_hu_image - min_hu_image)
+            raw_data /= (max_hu_image - min_hu_image)
+        return raw_data
 
     @property
     def calc_circle(self):
         """
-        Calculate the image center and radius
-        the method is simple
-        from up/down/left/right side to go into center
-        the 1st number is > mean value, it's the edge
-        calculate the distance from th edge to center
+        Calculate the image center and radius, see find_circle.
+        The sub-pixel center is stored in self.CenterSubPixel as (row, col)
         :return: return 2 tuples which are image center and radius
         (center row, center col),(radius in pixel, radius in cm)
         """
-        # set up some local variables
-        is_abnormal = False
-        center_col = self.Size[1] // 2
-        center_row = self.Size[0] // 2
-        left_distance = 0
-        right_distance = 0
-        up_distance = 0
-        low_distance = 0
-        max_allowed_deviation = 20
-        # Using PIL to find edge and convert back to np array
-        # This will make calculation more accuracy
-        filtered_image = np.array(
-            Image.fromarray(self.ImageRaw)
-                           .convert("L")
-                           .filter(ImageFilter.FIND_EDGES)
-        )
-
-        # start to calculate center col
-        for left_distance in range(1, self.Size[1]):
-            if filtered_image[center_row, left_distance] != 0:
-                break
-        for right_distance in range(1, self.Size[1]):
-            if filtered_image[center_row, self.Size[1] - right_distance] != 0:
-                break
-        center_col += (left_distance - right_distance) // 2
-        logging.debug(r"Center Col calculated as: " + str(center_col))
-        # if the calculated center col deviated too much
-        if (self.Size[0] // 2 + max_allowed_deviation) \
-           < center_col < \
-           (self.Size[0] // 2 - max_allowed_deviation):
-            logging.warning(r"It seems abnormal when calculate Center Col" +
-                            r", use image center now!")
-            center_col = self.Size[1] // 2
-            is_abnormal = True
-
-        # start to calculate center row
-        for up_distance in range(1, self.Size[0]):
-            if filtered_image[up_distance, center_col] != 0:
-                break
-        for low_distance in range(1, self.Size[0]):
-            if filtered_image[self.Size[0] - low_distance, center_col] != 0:
-                break
-        center_row += (up_distance - low_distance) // 2
-        logging.debug(r"Center Row calculated as: " + str(center_row))
-        # if the calculated center row deviated too much
-        if (self.Size[1] // 2 + max_allowed_deviation) < center_row < (self.Size[1] // 2 - max_allowed_deviation):
-            logging.warning(r"It seems abnormal when calculate Center row, use image center now!")
-            center_row = self.Size[0] // 2
-            is_abnormal = True
-
-        # set different radius according to normal/abnormal situation
-        if is_abnormal is False:
-            radius = (self.Size[0] - left_distance - right_distance) // 2
-            diameter_in_cm = radius * self.PixSpace[0] * 2
-            logging.debug(str(radius) + r"pix (radius), " + str(diameter_in_cm) +
-                          r"cm(diameter)<==Calculated phantom diameter")
-            # standardize the radius
-            if diameter_in_cm < 250:
-                radius = 233
-                logging.debug(str(radius) + r"pix" + r", which is: " +
-                              str(radius * self.PixSpace[0] * 2) + r"cm <==Radius Readjusted")
-            else:
-                radius = 220
-                logging.debug(str(radius) + r"pix" + r", which is: " +
-                              str(radius * self.PixSpace[0] * 2) + r"cm <==Radius Readjusted")
-        else:
-            logging.warning(r"Calculated center is abnormal, use 50 as radius!")
-            radius = 50
-            diameter_in_cm = radius * self.PixSpace[0]
-
-        return (center_row, center_col), (radius, diameter_in_cm)
+        center, radius, self.CenterSubPixel = find_circle(self.ImageHU, self.Size, self.PixSpace,
+                                                          self.DetectCenter)
+        return center, radius
 
     def bresenham(self, center: tuple, radius: int):
         """
@@ -192,24 +277,19 @@ class ImageHandler(DicomHandler):
 
     def roi_measure(self, center: tuple, radius):
         """
-        Use self.bresenham multiple times to get sum of all pixel value and the total count.
+        Measure the pixels of the bresenham circles with radius in range(1, radius).
         Then sum of pixcel value / total counts = mean hu value that is the mean HU in the circular ROI
         :param center: a tuple indicates where the circle center is as (row, col)
         :param radius: the radius in PIXEL
         :return: The mean HU value of the ROI
         """
-        result_hu = 0
-        result_count = 0
-        for index in range(1, radius):
-            _result = self.bresenham(center, index)
-            result_hu += _result[0]
-            result_count += _result[1]
-        return result_hu / result_count
+        return roi_mean(self.ImageHU, center, radius)
 
     def find_center_roi_min(self, radius, deviation):
         """
         Use a defined circle with radius to measure the HU value. And moving around the circle
         position in deviation range to find where the minum HU value is.
+        The ROI of all positions is measured at once by ImageMath.roi_mean_map.
         :param radius: The radius of circular ROI in PIXEL
         :param deviation: The Square range to let the circle moving around.
         :return: return a tuple as (min result, min position) where a min position is a tuple as (row, col)
@@ -218,16 +298,18 @@ class ImageHandler(DicomHandler):
         result_min = self.roi_measure(self.Center, 10)
         min_row = self.Center[0]
         min_col = self.Center[1]
-        result_temp = []
+        # measure all positions in range [center - deviation, center + deviation)
+        result_map = roi_mean_map(self.ImageHU,
+                                  (self.Center[0] - deviation, self.Center[1] - deviation),
+                                  (2 * deviation, 2 * deviation),
+                                  radius)
         # start to find the min HU value
-        for index_row in range(self.Center[0] - deviation, self.Center[0] + deviation):
-            for index_col in range(self.Center[1] - deviation, self.Center[1] + deviation):
-                result = self.roi_measure((index_row, index_col), radius)
-                result_temp.append(result)
-                if result < result_min:
-                    result_min = result       
-                    min_row = index_row
-                    min_col = index_col
+        if result_map.size > 0:
+            index = np.unravel_index(np.argmin(result_map), result_map.shape)
+            if result_map[index] < result_min:
+                result_min = float(result_map[index])
+                min_row = self.Center[0] - deviation + int(index[0])
+                min_col = self.Center[1] - deviation + int(index[1])
         # pack the min value position in image
         min_position = (min_row, min_col)
         return result_min, min_position
@@ -236,43 +318,22 @@ class ImageHandler(DicomHandler):
         """
         1st define a circle with center (row, col) and a radius in PIXEL. Then on each point on the edge of the
         defined circle, a ROI with radius_inner in PIXEL will be measured.
+        All ROIs are taken from one ROI mean map covering the defined circle.
         :param center: The defined circle center
         as a tuple (row, col)
         :param radius: The radius of the defined circle
         :param radius_inner: the radius of the
         ROI measurement on each point of the defined circle's edge.
         :return: return 2 values. 1) circular_result as a
-        list of the HU value. 2) a list contains position as (row, col) of each point
+        np array of the HU value. 2) a np array with shape (n, 2) contains position as (row, col) of each point
         """
-        x = 0
-        y = radius
-        d = 3 - 2 * radius
-        circular_result = []
-        circular_pos = []
-        while x < y:
-            circular_result.append(self.roi_measure((center[0] - y, center[1] + x), radius_inner))
-            circular_result.append(self.roi_measure((center[0] + y, center[1] + x), radius_inner))
-            circular_result.append(self.roi_measure((center[0] - y, center[1] - x), radius_inner))
-            circular_result.append(self.roi_measure((center[0] + y, center[1] - x), radius_inner))
-            circular_result.append(self.roi_measure((center[0] - x, center[1] + y), radius_inner))
-            circular_result.append(self.roi_measure((center[0] - x, center[1] - y), radius_inner))
-            circular_result.append(self.roi_measure((center[0] + x, center[1] + y), radius_inner))
-            circular_result.append(self.roi_measure((center[0] + x, center[1] - y), radius_inner))
-            # record the position to draw afterward
-            circular_pos.append(([center[0] - y, center[1] + x]))
-            circular_pos.append(([center[0] + y, center[1] + x]))
-            circular_pos.append(([center[0] - y, center[1] - x]))
-            circular_pos.append(([center[0] + y, center[1] - x]))
-            circular_pos.append(([center[0] - x, center[1] + y]))
-            circular_pos.append(([center[0] - x, center[1] - y]))
-            circular_pos.append(([center[0] + x, center[1] + y]))
-            circular_pos.append(([center[0] + x, center[1] - y]))
-            if d < 0:
-                d = d + 4 * x + 6
-            else:
-                d = d + 4 * (x - y) + 10
-                y -= 1
-            x += 1
+        rows, cols = bresenham_offsets(radius)
+        result_map = roi_mean_map(self.ImageHU,
+                                  (center[0] - radius, center[1] - radius),
+                                  (2 * radius + 1, 2 * radius + 1),
+                                  radius_inner)
+        circular_result = result_map[rows + radius, cols + radius]
+        circular_pos = np.stack((rows + center[0], cols + center[1]), axis=1)
         return circular_result, circular_pos
 
     def evaluate_iq(self, diameter_in_mm, deviation_in_mm):
@@ -280,11 +341,13 @@ class ImageHandler(DicomHandler):
         To compare the center min HU and around max HU
         :param diameter_in_mm:
         :param deviation_in_mm:
-        :return:
+        :return: an IqResult. The result is calculated once for each input, its arrays are read only.
         """
         if not self.isImageComplete:
             logging.warning(r"Image initialed incomplete. Procedure quited.")
             return
+        if (diameter_in_mm, deviation_in_mm) in self.__iq_results:
+            return self.__iq_results[(diameter_in_mm, deviation_in_mm)]
 
         # convert diamter_in_mm into radius in pixel
         # radius = int((diameter_in_mm / self.PixSpace[0]) / 2)
@@ -294,62 +357,59 @@ class ImageHandler(DicomHandler):
 
         min_hu, min_pos = self.find_center_roi_min(radius, deviation)
         result, pos = self.circular_bresenham(min_pos, radius * 2, radius)
-        max_hu = max(result)
-        for i in range(0, len(result)):
-            result[i] = result[i] - min_hu
+        max_hu = float(result.max())
+        result = result - min_hu
 
-        max_deviation = max(result)
-        max_dev_position = pos[result.index(max_deviation)]
-        
-        # experiment of find theta
-        theta = []
-        for p in pos:
-            y = min_pos[0]-p[0]
-            x = p[1]-min_pos[1]
-            if x == 0:
-                if y > 0:
-                    theta.append(90)
-                else:
-                    theta.append(270)
-            elif y == 0:
-                if x > 0:
-                    theta.append(0)
-                if x < 0:
-                    theta.append(180)
-            else:
-                if x > 0 and y > 0:
-                    theta.append(int(math.degrees(math.atan(y/x))))
-                elif x < 0 < y:
-                    theta.append(int((math.degrees(math.atan(y/x))*-1)+90))
-                elif x < 0 and y < 0:
-                    theta.append(int(math.degrees(math.atan(y/x))+180))
-                else:
-                    theta.append(int((math.degrees(math.atan(y/x))*-1)+270))
-        union_result = []
-        for i in range(0, len(result)):
-            union_result.append((theta[i], result[i]))
-        sorted_result_tuple = sorted(union_result, key=lambda t: t[0])
-        sorted_result = []
-        for r in sorted_result_tuple:
-            sorted_result.append(r[1])
-        return (sorted_result, min_hu, max_hu,
-                min_pos, max_dev_position,
-                deviation, max_deviation, radius)
-
-    def draw_sorted_iq_result(self, diameter_in_mm, deviation_in_mm):
+        max_index = int(np.argmax(result))
+        max_deviation = float(result[max_index])
+        max_dev_position = (int(pos[max_index, 0]), int(pos[max_index, 1]))
+
+        # theta of each point, row axis of the image points downward
+        theta = np.degrees(np.arctan2(min_pos[0] - pos[:, 0],
+                                      pos[:, 1] - min_pos[1])) % 360
+        order = np.argsort(theta, kind="mergesort")
+        sorted_result = result[order]
+        sorted_theta = theta[order]
+        # the memoized result is shared by all callers
+        sorted_result.flags.writeable = False
+        sorted_theta.flags.writeable = False
+        iq_result = IqResult(sorted_result, min_hu, max_hu,
+                             min_pos, max_dev_position,
+                             deviation, max_deviation, radius,
+                             sorted_theta)
+        self.__iq_results[(diameter_in_mm, deviation_in_mm)] = iq_result
+        return iq_result
+
+    def evaluate_iq_sweep(self, diameters_in_mm, deviations_in_mm):
+        """
+        Run evaluate_iq for each combination of ROI diameter and deviation.
+        :param diameters_in_mm: a list of ROI diameter
+        :param deviations_in_mm: a list of deviation
+        :return: a dict as {(diameter_in_mm, deviation_in_mm): IqResult}
+        """
+        if not self.isImageComplete:
+            logging.warning(r"Image initialed incomplete. Procedure quited.")
+            return
+        return {(diameter, deviation): self.evaluate_iq(diameter, deviation)
+                for diameter in diameters_in_mm
+                for deviation in deviations_in_mm}
+
+    def draw_sorted_iq_result(self, diameter_in_mm, deviation_in_mm, save=True):
+        """
+        Draw the IQ evaluation result on the image.
+        :param save: save the drawn image at the dicom path
+        :return: a tuple as (PIL image, plot data)
+        """
         # call evaluate_iq function to get result
-        # a bunch of result must referenced before usage
-        # TODO
-        # How to simplize the code structure??
         eiq = self.evaluate_iq(diameter_in_mm, deviation_in_mm)
-        result = eiq[0]
-        min_hu = eiq[1]
-        max_hu = eiq[2]
-        min_pos = eiq[3]
-        max_dev_position = eiq[4]
-        deviation = eiq[5]
-        max_deviation = eiq[6]
-        radius = eiq[7]
+        result = eiq.sorted_result
+        min_hu = eiq.min_hu
+        max_hu = eiq.max_hu
+        min_pos = eiq.min_pos
+        max_dev_position = eiq.max_dev_position
+        deviation = eiq.deviation
+        max_deviation = eiq.max_deviation
+        radius = eiq.radius
         # Prepare to draw the image evaluation fig plot
         # image__filename__fig = "_IqEval_fig.jpeg"
         limit_h = []
@@ -431,25 +491,58 @@ class ImageHandler(DicomHandler):
         draw.text((200, 120),
                   str("warning rate:" + 
                       str(warning_count/result_count*100)+"%"))
-        im.save(self.FileName + "_" + self.ScanMode + image__filename, "png")
+        if save:
+            im.save(self.FileName + "_" + self.ScanMode + image__filename, "png")
         return im, fig
 
+    def render_iq_image(self, diameter_in_mm, deviation_in_mm):
+        """
+        Same as draw_sorted_iq_result, but return the image as png bytes instead of saving it.
+        :return: a dict as {output file name: png bytes}
+        """
+        im, _ = self.draw_sorted_iq_result(diameter_in_mm, deviation_in_mm, save=False)
+        buf = io.BytesIO()
+        im.save(buf, "png")
+        return {self.FileName + "_" + self.ScanMode + "_IqEval.jpeg": buf.getvalue()}
+
     def integration(self):
         """
-        Circular integration by using bresenham
+        Circular integration of all radius in one pass. See ImageMath.radial_profile
         :return: no return. Directly Write self.Image_Integration_Result and
         self.Image_Median_Filter_result
         """
         # calculate circular integration for each radius
-        for index in range(1, len(self.Image_Integration_Result)):
-            result = self.bresenham(self.Center, index)
-            self.Image_Integration_Result[index] = result[0] / result[1]
+        self.__integration_result = radial_profile(
+            self.ImageHU, self.Center, self.Radius[0], self.ProfileMethod)
         # calculate data by using Median
-        # for the rest of the data, do the median filter with width
-        _width = 8
-        for index in range(len(self.Image_Integration_Result) - _width):
-            self.Image_Median_Filter_Result[index] = np.median(
-                self.Image_Integration_Result[index:index + _width])
+        self.__median_filter_result = median_filter(
+            self.__integration_result, self.MedianWidth, self.MedianTail)
+
+    def render_image(self):
+        """
+        Render the image and the plot of the integration result.
+        :return: a dict as {output file name: image bytes}
+        """
+        # set up the output file name
+        image__filename = ".jpeg"
+        image__filename__fig = "_fig.jpeg"
+        images = {}
+        im = Image.fromarray(self.ImageRaw).convert("L")
+        buf = io.BytesIO()
+        im.save(buf, "png")
+        images[self.FileName + "_" + self.ScanMode + image__filename] = buf.getvalue()
+        # draw fig, without pyplot so it is safe in any thread and needs no GUI backend
+        figure = Figure()
+        FigureCanvasAgg(figure)
+        axes = figure.add_subplot(111)
+        axes.plot(self.Image_Median_Filter_Result)
+        axes.set_ylim((-5, 20))
+        axes.set_xlim((0, 250))
+        # draw fig image
+        buf = io.BytesIO()
+        figure.savefig(buf, format="jpeg")
+        images[self.FileName + "_" + self.ScanMode + image__filename__fig] = buf.getvalue()
+        return images
 
     def save_image(self):
         """
@@ -459,30 +552,14 @@ class ImageHandler(DicomHandler):
         if not self.isImageComplete:
             logging.warning(r"Image initialed incomplete. Procedure quited.")
             return
-        # set up the output file name
-        image__filename = ".jpeg"
-        image__filename__fig = "_fig.jpeg"
-        im = Image.fromarray(self.ImageRaw).convert("L")
         # save image
         try:
-            # save image
-            im.save(self.FileName + "_" +
-                    self.ScanMode +
-                    image__filename, "png")
-            # draw fig
-            plt.plot(self.Image_Median_Filter_Result)
-            plt.ylim((-5, 20))
-            plt.xlim((0, 250))
-            # draw fig image
-            plt.savefig(self.FileName + "_" +
-                        self.ScanMode +
-                        image__filename__fig)
-            plt.close()
+            for name, image in self.render_image().items():
+                with open(name, "wb") as fp:
+                    fp.write(image)
         except Exception as e:
             logging.error(str(e))
             return
-        finally:
-            plt.close()
 
     def show_image(self):
         """
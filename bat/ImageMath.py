@@ -0,0 +1,191 @@
+import numpy as np
+from bat.CircleGeometry import ring_offsets
+from bat.CircleGeometry import ring_label_image
+from bat.CircleGeometry import disk_weights
+
+
+Profile_Methods = ("bresenham", "euclidean")
+# tail handling of median_filter
+Median_Tails = ("zero", "shrink")
+# HU value between air (-1000) and water (0) to separate phantom and air
+Phantom_Threshold = -500.0
+
+
+def radial_profile(image, center: tuple, max_radius: int, method="bresenham"):
+    """
+    Calculate the mean HU value of each circle around the center in one pass.
+    "bresenham" uses exactly the pixels of ImageHandler.bresenham so the result
+    stays comparable with the stored data. "euclidean" uses the rounded pixel
+    distance to the center, so every pixel inside max_radius is counted once.
+    :param image: a 2D image, or a stack of images with shape (..., rows, cols)
+    :param center: a tuple indicates the circle center as (row, col)
+    :param max_radius: the length of the result. Index 0 is always 0.
+    :param method: "bresenham" or "euclidean"
+    :return: np array with shape (..., max_radius) of the mean value per radius
+    """
+    image = np.asarray(image)
+    center = (int(center[0]), int(center[1]))
+    if method == "bresenham":
+        rows, cols, labels = ring_offsets(max_radius)
+        values = image[..., center[0] + rows, center[1] + cols]
+    elif method == "euclidean":
+        labels = ring_label_image(image.shape[-2:], center, max_radius).ravel()
+        values = image.reshape(image.shape[:-2] + (-1,))
+    else:
+        raise ValueError("Unknown profile method: " + str(method))
+    # give each image in the stack its own range of bins
+    # so the whole stack is summed by one bincount call
+    bins_per_image = max_radius + 1
+    stack_shape = values.shape[:-1]
+    values = values.reshape(-1, values.shape[-1])
+    bins = labels + bins_per_image * np.arange(values.shape[0])[:, np.newaxis]
+    sums = np.bincount(bins.ravel(), weights=values.ravel(),
+                       minlength=bins_per_image * values.shape[0])
+    sums = sums.reshape(values.shape[0], bins_per_image)[:, :max_radius]
+    counts = np.bincount(labels, minlength=bins_per_image)[:max_radius]
+    counts[0] = 0
+    profile = np.zeros(sums.shape)
+    profile[:, counts > 0] = sums[:, counts > 0] / counts[counts > 0]
+    return profile.reshape(stack_shape + (max_radius,))
+
+
+def roi_mean(image, center: tuple, radius: int):
+    """
+    Calculate the mean value of a circular ROI, same as ImageHandler.roi_measure.
+    :param image: the 2D image
+    :param center: a tuple indicates where the ROI center is as (row, col)
+    :param radius: the radius in PIXEL
+    :return: the mean value of the ROI
+    """
+    # same arithmetic as roi_mean_map, so a ROI measured alone equals the map value
+    return float(roi_mean_map(image, (int(center[0]), int(center[1])), (1, 1), radius)[0, 0])
+
+
+def roi_mean_map(image, origin: tuple, grid_shape: tuple, radius: int):
+    """
+    Calculate the circular ROI mean value for every center of a rectangular grid
+    at once. Each kernel pixel is added for the whole grid by one shifted slice,
+    instead of measuring the ROI again at each position.
+    The pixels are added in the same order for every position, so equal ROIs give
+    exactly equal means and the first minimum or maximum is kept as the loop did.
+    :param image: the 2D image
+    :param origin: the 1st ROI center of the grid as (row, col)
+    :param grid_shape: the number of grid positions as (rows, cols)
+    :param radius: the radius of the ROI in PIXEL
+    :return: np array with shape grid_shape, where result[i, j] is the ROI
+    mean value with center (origin[0] + i, origin[1] + j)
+    """
+    if grid_shape[0] <= 0 or grid_shape[1] <= 0:
+        return np.zeros((max(grid_shape[0], 0), max(grid_shape[1], 0)))
+    weights = disk_weights(radius)
+    # a ROI beyond the image raises IndexError like roi_mean does,
+    # a negative index still wraps around like numpy
+    for axis in range(2):
+        first = origin[axis] - radius
+        last = origin[axis] + grid_shape[axis] - 1 + radius
+        if first < -image.shape[axis] or last >= image.shape[axis]:
+            raise IndexError("ROI index " + str(first if first < 0 else last) +
+                             " is out of bounds for axis " + str(axis) +
+                             " with size " + str(image.shape[axis]))
+    # cut the window covering all ROIs
+    window_rows = np.arange(origin[0] - radius,
+                            origin[0] + grid_shape[0] + radius) % image.shape[0]
+    window_cols = np.arange(origin[1] - radius,
+                            origin[1] + grid_shape[1] + radius) % image.shape[1]
+    window = image[np.ix_(window_rows, window_cols)]
+    # correlation: result[i, j] = sum(weights * window[i:i+k, j:j+k])
+    result = np.zeros(tuple(grid_shape))
+    for row, col in zip(*np.nonzero(weights)):
+        result += weights[row, col] * window[row:row + grid_shape[0], col:col + grid_shape[1]]
+    return result / weights.sum()
+
+
+def find_edges(line, threshold=Phantom_Threshold):
+    """
+    Find the 1st and the last position where the line crosses the threshold.
+    The position is linear interpolated between 2 pixels to get sub-pixel accuracy.
+    :param line: a 1D np array, e.g. one row of the HU image
+    :param threshold: the HU value of the edge
+    :return: a tuple as (first edge, last edge) in pixel, or None if no pixel is above threshold
+    """
+    line = np.asarray(line, dtype=np.float64)
+    inside = line > threshold
+    if not inside.any():
+        return None
+    first = int(np.argmax(inside))
+    last = len(line) - 1 - int(np.argmax(inside[::-1]))
+    first_edge = float(first)
+    last_edge = float(last)
+    if first > 0:
+        first_edge -= float((line[first] - threshold) / (line[first] - line[first - 1]))
+    if last < len(line) - 1:
+        last_edge += float((line[last] - threshold) / (line[last] - line[last + 1]))
+    return first_edge, last_edge
+
+
+def find_phantom(image, threshold=Phantom_Threshold):
+    """
+    Find the phantom center and radius from its edges on the center row and column.
+    The center col is calculated from the center row of the image, then the center
+    row is calculated from the found center col.
+    :param image: the 2D HU image
+    :param threshold: the HU value of the phantom edge
+    :return: a tuple as (center row, center col, radius) in sub-pixel,
+    or None if the phantom is not found
+    """
+    image = np.asarray(image)
+    edges = find_edges(image[image.shape[0] // 2, :], threshold)
+    if edges is None:
+        return None
+    center_col = (edges[0] + edges[1]) / 2
+    radius = (edges[1] - edges[0]) / 2
+    edges = find_edges(image[:, int(round(center_col))], threshold)
+    if edges is None:
+        return None
+    center_row = (edges[0] + edges[1]) / 2
+    return center_row, center_col, radius
+
+
+def sliding_window(array, width: int):
+    """
+    Read only strided view of all windows along the last axis, without copy.
+    :param array: np array with shape (..., n), n >= width
+    :param width: the window width
+    :return: np array view with shape (..., n - width + 1, width)
+    """
+    array = np.asarray(array)
+    shape = array.shape[:-1] + (array.shape[-1] - width + 1, width)
+    strides = array.strides + (array.strides[-1],)
+    return np.lib.stride_tricks.as_strided(array, shape=shape, strides=strides,
+                                           writeable=False)
+
+
+def median_filter(profile, width=8, tail="zero"):
+    """
+    Median filter along the last axis, result[..., i] = median(profile[..., i:i + width]).
+    A whole stack of profiles is filtered in one call.
+    :param profile: np array with shape (..., n)
+    :param width: the window width
+    :param tail: how to fill the last width positions where the window is not full.
+    "zero": fill with 0 as the stored results do.
+    "shrink": use the median of the remaining values.
+    :return: np array with the same shape as profile
+    """
+    if width < 1:
+        raise ValueError("Median filter width must be >= 1, got: " + str(width))
+    profile = np.asarray(profile, dtype=np.float64)
+    length = profile.shape[-1]
+    if tail == "zero":
+        result = np.zeros(profile.shape)
+        # same as the stored results, the last full window is not used either
+        count = length - width
+        if count > 0:
+            windows = sliding_window(profile, width)[..., :count, :]
+            result[..., :count] = np.median(windows, axis=-1)
+    elif tail == "shrink":
+        padding = np.full(profile.shape[:-1] + (width - 1,), np.nan)
+        padded = np.concatenate((profile, padding), axis=-1)
+        result = np.nanmedian(sliding_window(padded, width), axis=-1)
+    else:
+        raise ValueError("Unknown median tail: " + str(tail))
+    return result
@@ -0,0 +1,121 @@
+import os
+import json
+import sqlite3
+import logging
+import threading
+
+
+class ScanIndexHandler:
+    """
+    A persistent index of the scanned files, stored in a sqlite3 database
+    next to the BandAssessment database.
+    Each file is recorded with its size, mtime, header and processing status,
+    so only new or changed files need to be opened on the next scan.
+    """
+    Database_Name = "ScanIndex.sqlite3.db"
+    # processing status of a file
+    Status_New = "new"
+    Status_Rejected = "rejected"
+    # a dicom file which does not match the study description
+    Status_Skipped = "skipped"
+    Status_Done = "done"
+    Status_Failed = "failed"
+
+    def __init__(self, database_name=None):
+        """
+        :param database_name: the sqlite3 database file. Default is Database_Name
+        """
+        self.isComplete = False
+        if database_name is not None:
+            self.Database_Name = database_name
+        self.__lock = threading.Lock()
+        try:
+            # the index may be shared by several threads
+            self.Connection = sqlite3.connect(self.Database_Name, check_same_thread=False)
+            self.Connection.execute('''create table if not exists ScanIndex(
+                                         path text primary key,
+                                         size integer,
+                                         mtime real,
+                                         header text,
+                                         status text);''')
+            self.Connection.commit()
+        except sqlite3.Error as e:
+            logging.error(str(e))
+            return
+        self.isComplete = True
+        logging.debug(r"Scan index " + self.Database_Name + " opened.")
+
+    def lookup(self, path, stat=None):
+        """
+        Get the stored record of an unchanged file.
+        :param path: full file path
+        :param stat: os.stat result of the file, will be read if None
+        :return: a tuple as (header, status) if the file has the same size and mtime
+        as stored, else None. header is None for a non dicom file.
+        """
+        if stat is None:
+            stat = os.stat(path)
+        with self.__lock:
+            row = self.Connection.execute(
+                "select size, mtime, header, status from ScanIndex where path = ?;",
+                (path,)).fetchone()
+        if row is None or row[0] != stat.st_size or row[1] != stat.st_mtime:
+            return None
+        header = json.loads(row[2]) if row[2] is not None else None
+        return header, row[3]
+
+    def update(self, path, header, status, stat=None):
+        """
+        Insert or replace the record of a file.
+        :param path: full file path
+        :param header: the header dict from DicomHandler.read_header, or None
+        :param status: one of the Status_* values
+        :param stat: os.stat result of the file, will be read if None
+        :return: no return
+        """
+        if stat is None:
+            stat = os.stat(path)
+        header_string = json.dumps(header) if header is not None else None
+        with self.__lock:
+            self.Connection.execute(
+                "insert or replace into ScanIndex values (?,?,?,?,?);",
+                (path, stat.st_size, stat.st_mtime, header_string, status))
+
+    def set_status(self, path, status):
+        """
+        Update the processing status of a file, e.g. after it is analyzed.
+        :param path: full file path
+        :param status: one of the Status_* values
+        :return: no return
+        """
+        with self.__lock:
+            self.Connection.execute("update ScanIndex set status = ? where path = ?;",
+                                    (status, path))
+
+    def count(self, directory, statuses):
+        """
+        Count the indexed files in a folder with the given status,
+        e.g. to know the number of files of a run before the folder is scanned.
+        :param directory: the folder, its sub folders are included
+        :param statuses: a list of the Status_* values
+        :return: the number of files
+        """
+        prefix = os.path.join(os.path.abspath(directory), "")
+        statuses = list(statuses)
+        with self.__lock:
+            return self.Connection.execute(
+                "select count(*) from ScanIndex where substr(path, 1, ?) = ? and status in (" +
+                ",".join("?" * len(statuses)) + ");",
+                [len(prefix), prefix] + statuses).fetchone()[0]
+
+    def commit(self):
+        with self.__lock:
+            self.Connection.commit()
+
+    def close(self):
+        self.commit()
+        self.Connection.close()
+
+
+if __name__ == '__main__':
+    print("please do not use it individually unless of debugging.")
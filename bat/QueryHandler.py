@@ -0,0 +1,249 @@
+import sqlite3
+import logging
+import pathlib
+import datetime
+import numpy as np
+from bat.DatabaseHandler import SQL3Handler
+from bat.DatabaseHandler import Schema_Version
+from bat.DatabaseHandler import schema_version
+from bat.DatabaseHandler import Trend_Bucket
+from bat.DatabaseHandler import Trend_Dtype
+
+
+class QueryHandler:
+    """
+    Select stored BandAssessments by their metadata.
+    The result is columnar: a dict of np arrays, one per metadata column,
+    and one (records, radius) np matrix of the integration results.
+    Shorter integration results are padded with NaN.
+    All filters are optional, a filter can be one value or a list of values, e.g.
+        QueryHandler().query(serial_number=12345, kernel="Hr40f", slice_mode="16x1.2",
+                             start="20180101", end="20180401")
+    """
+    Database_Name = SQL3Handler.Database_Name
+    # metadata columns and their np dtype
+    Metadata_Columns = (("uid", object),
+                        ("modality", object),
+                        ("serial_number", np.int64),
+                        ("kvp", np.float64),
+                        ("current", np.int64),
+                        ("kernel", object),
+                        ("total_collimation", np.float64),
+                        ("slice_thickness", np.float64),
+                        ("slice_mode", object),
+                        ("instance", np.int64),
+                        ("acquisition_datetime", object),
+                        ("profile_length", np.int64))
+    # BandTrends columns given by trends and their np dtype
+    Trend_Columns = (("serial_number", np.int64),
+                     ("kernel", object),
+                     ("total_collimation", np.float64),
+                     ("kvp", np.float64),
+                     ("bucket", object),
+                     ("count", np.int64))
+    # {filter name: column}
+    Filters = {"serial_number": "serial_number",
+               "modality": "modality",
+               "kernel": "kernel",
+               "kvp": "kvp",
+               "collimation": "total_collimation",
+               "slice_mode": "slice_mode"}
+
+    def __init__(self, database_name=None):
+        """
+        :param database_name: the sqlite3 database file. Default is Database_Name
+        """
+        self.isComplete = False
+        if database_name is not None:
+            self.Database_Name = database_name
+        try:
+            # as_uri quotes "?", "#" and "%" in the path, and handles a windows drive
+            uri = pathlib.Path(self.Database_Name).resolve().as_uri() + "?mode=ro"
+            self.Connection = sqlite3.connect(uri, uri=True)
+            version = schema_version(self.Connection)
+        except sqlite3.Error as e:
+            logging.error(str(e))
+            return
+        if version != Schema_Version:
+            logging.error(r"Database schema version is " + str(version) + " instead of " +
+                          str(Schema_Version) + ". Please run migrateDatabase.py.")
+            self.Connection.close()
+            return
+        self.isComplete = True
+
+    @staticmethod
+    def date_time(value):
+        """
+        :param value: datetime.date, datetime.datetime or a dicom date time string
+        :return: the dicom date time string, as stored in acquisition_datetime
+        """
+        if isinstance(value, datetime.datetime):
+            return value.strftime("%Y%m%d%H%M%S")
+        if isinstance(value, datetime.date):
+            return value.strftime("%Y%m%d")
+        return str(value)
+
+    def where(self, start=None, end=None, date_column="acquisition_datetime", filter_names=None,
+              **filters):
+        """
+        Build the where clause of the filters.
+        :param start: the first acquisition date time, included
+        :param end: the last acquisition date time, excluded
+        :param date_column: the column compared with start and end
+        :param filter_names: the allowed filters, None for all Filters
+        :param filters: see Filters
+        :return: a tuple as (sql string, parameters)
+        """
+        conditions = []
+        parameters = []
+        for name, value in filters.items():
+            if name not in self.Filters or (filter_names is not None and name not in filter_names):
+                raise ValueError(r"Unknown filter: " + str(name))
+            if value is None:
+                continue
+            column = self.Filters[name]
+            if isinstance(value, (list, tuple, set)):
+                value = list(value)
+                conditions.append(column + " in (" + ",".join("?" * len(value)) + ")")
+                parameters.extend(value)
+            else:
+                conditions.append(column + " = ?")
+                parameters.append(value)
+        if start is not None:
+            conditions.append(date_column + " >= ?")
+            parameters.append(self.date_time(start))
+        if end is not None:
+            conditions.append(date_column + " < ?")
+            parameters.append(self.date_time(end))
+        if not conditions:
+            return "", parameters
+        return " where " + " and ".join(conditions), parameters
+
+    def count(self, **filters):
+        """
+        :param filters: see where
+        :return: the number of matching records
+        """
+        sql_string, parameters = self.where(**filters)
+        return self.Connection.execute(r"select count(*) from BandAssessments" + sql_string + ";",
+                                       parameters).fetchone()[0]
+
+    def iter_chunks(self, chunk_size=10000, **filters):
+        """
+        Read the matching records chunk by chunk, ordered by acquisition date time.
+        :param chunk_size: the max number of records in one chunk
+        :param filters: see where
+        :return: a generator of (metadata, profiles) as query
+        """
+        sql_string, parameters = self.where(**filters)
+        columns = ", ".join(name for name, _ in self.Metadata_Columns)
+        cursor = self.Connection.execute(
+            r"select " + columns + ", integration_result, profile_dtype, profile_length "
+            r"from BandAssessments" + sql_string + " order by acquisition_datetime, uid;",
+            parameters)
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                return
+            yield self.__columns(rows, self.Metadata_Columns), self.__profiles(rows)
+
+    def query(self, chunk_size=10000, **filters):
+        """
+        Read all matching records.
+        :param chunk_size: the number of records read from sqlite at once
+        :param filters: see where
+        :return: a tuple as (metadata, profiles). metadata is a dict of
+        {column: np array}, profiles is a np matrix with shape (records, radius)
+        """
+        chunks = list(self.iter_chunks(chunk_size, **filters))
+        if not chunks:
+            return self.__columns([], self.Metadata_Columns), np.empty((0, 0), dtype=np.float32)
+        metadata = {name: np.concatenate([chunk[0][name] for chunk in chunks])
+                    for name, _ in self.Metadata_Columns}
+        width = max(chunk[1].shape[1] for chunk in chunks)
+        profiles = np.full((len(metadata["uid"]), width), np.nan, dtype=np.float32)
+        row = 0
+        for _, chunk in chunks:
+            profiles[row:row + chunk.shape[0], :chunk.shape[1]] = chunk
+            row += chunk.shape[0]
+        return metadata, profiles
+
+    @staticmethod
+    def __columns(rows, columns):
+        """
+        :param rows: the rows read from sqlite
+        :param columns: the (name, dtype) of the first columns of the rows
+        :return: a dict of {column: np array}
+        """
+        metadata = {}
+        for index, (name, dtype) in enumerate(columns):
+            values = [row[index] for row in rows]
+            try:
+                metadata[name] = np.array(values, dtype=dtype)
+            except (TypeError, ValueError):
+                # e.g. None in a number column
+                metadata[name] = np.array(values, dtype=object)
+        return metadata
+
+    def __profiles(self, rows):
+        """
+        :return: the integration results in rows as np matrix, padded with NaN.
+        It is read only if no padding is needed.
+        """
+        offset = len(self.Metadata_Columns)
+        blobs = [row[offset] for row in rows]
+        dtypes = {row[offset + 1] for row in rows}
+        lengths = [row[offset + 2] for row in rows]
+        width = max(lengths)
+        if len(dtypes) == 1 and min(lengths) == width:
+            # the usual case, all profiles have the same length
+            return np.frombuffer(b"".join(blobs), dtype=np.dtype(dtypes.pop())).reshape(len(rows), width)
+        profiles = np.full((len(rows), width), np.nan, dtype=np.float32)
+        for index, row in enumerate(rows):
+            blob, dtype, length = row[offset:offset + 3]
+            profiles[index, :length] = np.frombuffer(blob, dtype=np.dtype(dtype), count=length)
+        return profiles
+
+    def trends(self, start=None, end=None, **filters):
+        """
+        Read the statistics of BandTrends, one row per scanner, protocol and time bucket.
+        The time buckets are compared with the first characters of start and end,
+        so a bucket is selected if it begins in [start, end).
+        :param start: see where
+        :param end: see where
+        :param filters: serial_number, kernel, collimation and kvp, see where
+        :return: a tuple as (metadata, statistics). metadata is a dict of {column: np array}
+        with the key columns and "count". statistics is a dict of np matrix with shape
+        (rows, radius) for "mean", "std" and "max_abs", padded with NaN.
+        """
+        if start is not None:
+            start = self.date_time(start)[:Trend_Bucket]
+        if end is not None:
+            end = self.date_time(end)[:Trend_Bucket]
+        sql_string, parameters = self.where(start, end, date_column="bucket",
+                                            filter_names=("serial_number", "kernel", "collimation", "kvp"),
+                                            **filters)
+        rows = self.Connection.execute(
+            r"select serial_number, kernel, total_collimation, kvp, bucket, count, "
+            r"sum, sum_square, max_abs, profile_length from BandTrends" + sql_string +
+            " order by serial_number, kernel, total_collimation, kvp, bucket;",
+            parameters).fetchall()
+        metadata = self.__columns(rows, self.Trend_Columns)
+        width = max((row[9] for row in rows), default=0)
+        statistics = {name: np.full((len(rows), width), np.nan) for name in ("mean", "std", "max_abs")}
+        for index, row in enumerate(rows):
+            count, length = row[5], row[9]
+            mean = np.frombuffer(row[6], dtype=Trend_Dtype) / count
+            square = np.frombuffer(row[7], dtype=Trend_Dtype) / count
+            statistics["mean"][index, :length] = mean
+            # population std, rounding can make the variance slightly negative
+            statistics["std"][index, :length] = np.sqrt(np.maximum(square - mean * mean, 0.0))
+            statistics["max_abs"][index, :length] = np.frombuffer(row[8], dtype=Trend_Dtype)
+        return metadata, statistics
+
+    def close(self):
+        self.Connection.close()
+
+
+if __name__ == '__main__':
+    print("please do not use it individually unless of debugging.")
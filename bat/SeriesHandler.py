@@ -0,0 +1,122 @@
+import logging
+import numpy as np
+from bat.DicomHandler import DicomHandler
+from bat.DicomHandler import read_header
+from bat.ImageHandler import find_circle
+from bat.ImageMath import radial_profile
+from bat.ImageMath import median_filter
+
+
+class SeriesHandler:
+    """
+    SeriesHandler analyzes all slices of one dicom series as one 3D stack.
+    The HU conversion, center detection and circular integration are done
+    once for the whole stack instead of once per ImageHandler.
+    """
+
+    def __init__(self, filenames, profile_method="bresenham", detect_center=False,
+                 median_width=8, median_tail="zero", slab=1):
+        """
+        Initialization function
+        :param filenames: the dicom file names of one series including path
+        :param profile_method: see ImageHandler
+        :param detect_center: see ImageHandler
+        :param median_width: see ImageHandler
+        :param median_tail: see ImageHandler
+        :param slab: if > 1, also calculate the profile averaged over each slab
+        of so many neighbouring slices into self.Slab_Median_Filter_Result
+        """
+        self.isSeriesComplete = False
+        self.ProfileMethod = profile_method
+        self.MedianWidth = median_width
+        self.MedianTail = median_tail
+        self.Slices = []
+        for filename in filenames:
+            dicom = DicomHandler(filename)
+            if dicom.isComplete:
+                self.Slices.append(dicom)
+        if len(self.Slices) == 0:
+            logging.warning(r"No valid slice in series. Procedure quited.")
+            return
+        self.Slices.sort(key=lambda s: s.Instance)
+
+        try:
+            # series related, taken from the 1st slice
+            first = self.Slices[0]
+            self.SerialNumber = first.SerialNumber
+            self.Modality = first.Modality
+            self.Series = first.Series
+            self.DateTime = first.DateTime
+            self.Kernel = first.Kernel
+            self.ScanMode = first.ScanMode
+            self.Size = first.Size
+            self.PixSpace = first.PixSpace
+            if any(s.Size != self.Size for s in self.Slices):
+                logging.error(r"Slices of the series have different size. Procedure quited.")
+                return
+
+            # Convert to HU unit as one (slices, rows, cols) stack
+            self.ImageHU = np.empty((len(self.Slices),) + tuple(self.Size), dtype=np.float32)
+            for index, dicom in enumerate(self.Slices):
+                self.ImageHU[index] = dicom.RawData
+                dicom.RawData = None
+                dicom.release_pixel_data()
+            slope = np.array([float(s.Slop) for s in self.Slices], dtype=np.float32)
+            intercept = np.array([float(s.Intercept) for s in self.Slices], dtype=np.float32)
+            self.ImageHU *= slope[:, np.newaxis, np.newaxis]
+            self.ImageHU += intercept[:, np.newaxis, np.newaxis]
+
+            # center and radius are calculated once on the mean image of the series
+            self.Center, self.Radius, self.CenterSubPixel = find_circle(
+                self.ImageHU.mean(axis=0), self.Size, self.PixSpace, detect_center)
+            if not detect_center:
+                self.Center = (self.Size[0] // 2, self.Size[1] // 2)
+
+            # main calculation, one row per slice
+            self.Image_Integration_Result = radial_profile(
+                self.ImageHU, self.Center, self.Radius[0], self.ProfileMethod)
+            self.Image_Median_Filter_Result = median_filter(
+                self.Image_Integration_Result, self.MedianWidth, self.MedianTail)
+            self.Slab_Median_Filter_Result = None
+            if slab > 1:
+                self.Slab_Median_Filter_Result = self.slab_profiles(slab)
+        except Exception as e:
+            logging.error(str(e))
+            return
+        self.isSeriesComplete = True
+        logging.info(r"Series " + str(self.Series) + " with " +
+                     str(len(self.Slices)) + " slices initialed OK.")
+
+    def slab_profiles(self, slab: int):
+        """
+        Average the integration result over each slab of neighbouring slices
+        to reduce noise, then do the median filter.
+        The last slab may contain less slices.
+        :param slab: the number of slices in one slab
+        :return: np array with shape (number of slabs, radius)
+        """
+        slices = self.Image_Integration_Result.shape[0]
+        starts = np.arange(0, slices, slab)
+        sums = np.add.reduceat(self.Image_Integration_Result, starts, axis=0)
+        counts = np.diff(np.append(starts, slices))
+        return median_filter(sums / counts[:, np.newaxis], self.MedianWidth, self.MedianTail)
+
+    @staticmethod
+    def group_series(filenames):
+        """
+        Group the dicom files by series, only the dicom header is read.
+        :param filenames: a list of dicom file names
+        :return: a dict as {(serial number, date time, series): [file names]}
+        """
+        groups = {}
+        for filename in filenames:
+            header = read_header(filename)
+            if header is None:
+                continue
+            key = (header["SerialNumber"], header["DateTime"], header["Series"])
+            groups.setdefault(key, []).append(filename)
+        return groups
+
+
+if __name__ == '__main__':
+    print("please do not use it individually unless of debugging.")
@@ -0,0 +1,111 @@
+import logging
+import threading
+import numpy as np
+try:
+    from multiprocessing import shared_memory
+except ImportError:
+    # python < 3.8, BatchPipeline sends the pixel data to the workers pickled instead
+    shared_memory = None
+
+# True if SlabPool can be used
+Shared_Memory_Available = shared_memory is not None
+
+# the shared memory blocks attached in this process, as {name: SharedMemory}
+_Attached = {}
+
+
+def attach(descriptor):
+    """
+    Get the array of a slot in a worker process without copying it.
+    The block is attached once per process and kept for the next slots.
+    :param descriptor: a tuple as (block name, offset, shape, dtype) from SlabPool.put
+    :return: a read only np array on the shared memory
+    """
+    name, offset, shape, dtype = descriptor
+    block = _Attached.get(name)
+    if block is None:
+        # the worker processes share the resource tracker of the main process,
+        # the block is unlinked once by SlabPool.close
+        block = shared_memory.SharedMemory(name=name)
+        _Attached[name] = block
+    array = np.ndarray(shape, dtype=np.dtype(dtype), buffer=block.buf, offset=offset)
+    array.flags.writeable = False
+    return array
+
+
+class SlabPool:
+    """
+    A pool of fixed size slots in one shared memory block, to give decoded
+    pixel arrays to worker processes without pickling them.
+    The main process puts an array into a free slot and sends the descriptor,
+    the worker wraps the slot as np array with attach.
+    The slot is released by the main process when the worker has returned.
+    """
+
+    def __init__(self, slots=32, slot_bytes=512 * 512 * 8):
+        """
+        :param slots: number of slots
+        :param slot_bytes: size of each slot, the default fits a 512x512 float64 image
+        """
+        self.Slots = slots
+        self.SlotBytes = slot_bytes
+        self.Block = shared_memory.SharedMemory(create=True, size=slots * slot_bytes)
+        self.__free = list(range(slots))
+        self.__condition = threading.Condition()
+        logging.debug(r"Shared memory " + self.Block.name + " created with " +
+                      str(slots) + " slots.")
+
+    def fits(self, array):
+        """
+        :param array: np array
+        :return: True if the array fits in one slot
+        """
+        return array.nbytes <= self.SlotBytes
+
+    def acquire(self):
+        """
+        Wait until a slot is free and take it.
+        :return: the slot number
+        """
+        with self.__condition:
+            while not self.__free:
+                self.__condition.wait()
+            return self.__free.pop()
+
+    def release(self, slot):
+        """
+        Give a slot back to the pool.
+        :param slot: the slot number
+        :return: no return
+        """
+        with self.__condition:
+            self.__free.append(slot)
+            self.__condition.notify()
+
+    def put(self, array):
+        """
+        Copy an array into a free slot, wait if no slot is free.
+        :param array: np array not larger than SlotBytes
+        :return: a tuple as (slot, descriptor). Give the descriptor to attach,
+        and the slot to release when the worker has returned.
+        """
+        if not self.fits(array):
+            raise ValueError(r"Array of " + str(array.nbytes) + " bytes does not fit in a slot.")
+        slot = self.acquire()
+        offset = slot * self.SlotBytes
+        view = np.ndarray(array.shape, dtype=array.dtype, buffer=self.Block.buf, offset=offset)
+        view[...] = array
+        del view
+        return slot, (self.Block.name, offset, array.shape, array.dtype.str)
+
+    def close(self):
+        """
+        Free the shared memory. No worker shall use the slots any more.
+        :return: no return
+        """
+        self.Block.close()
+        self.Block.unlink()
+
+
+if __name__ == '__main__':
+    print("please do not use it individually unless of debugging.")
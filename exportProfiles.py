@@ -0,0 +1,38 @@
+from bat.ExportHandler import ExportHandler
+import argparse
+import logging
+
+logging.basicConfig(level=logging.INFO,
+                    format='%(asctime)s %(filename)s[line:%(lineno)d] %(levelname)s %(message)s',
+                    datefmt='%a, %d %b %Y %H:%M:%S',
+                    filename=r'./Export.log',
+                    filemode='w')
+# define a stream that will show log level > ERROR on screen also
+console = logging.StreamHandler()
+console.setLevel(logging.INFO)
+formatter = logging.Formatter('%(levelname)-8s %(message)s')
+console.setFormatter(formatter)
+logging.getLogger('').addHandler(console)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export the stored integration results to .npy files.")
+    parser.add_argument("output", nargs="?", default=r'.\export',
+                        help="the folder to write profiles.npy and metadata.npy in")
+    parser.add_argument("--database", default=None,
+                        help="the sqlite3 database file")
+    parser.add_argument("--append", action="store_true",
+                        help="only add the records which are not exported yet")
+    args = parser.parse_args()
+
+    exporter = ExportHandler(args.output, database_name=args.database)
+    count = exporter.export(append=args.append)
+    exporter.close()
+    if count is None:
+        print("Export failed, see the log.")
+    else:
+        print(str(count) + " records exported.")
+
+
+if __name__ == '__main__':
+    main()
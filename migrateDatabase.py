@@ -0,0 +1,33 @@
+from bat.DatabaseHandler import SQL3Handler
+from bat.DatabaseHandler import Schema_Version
+from bat.DatabaseHandler import migrate_database
+import argparse
+import logging
+
+logging.basicConfig(level=logging.INFO,
+                    format='%(asctime)s %(filename)s[line:%(lineno)d] %(levelname)s %(message)s',
+                    datefmt='%a, %d %b %Y %H:%M:%S',
+                    filename=r'./Migrate.log',
+                    filemode='w')
+# define a stream that will show log level > ERROR on screen also
+console = logging.StreamHandler()
+console.setLevel(logging.INFO)
+formatter = logging.Formatter('%(levelname)-8s %(message)s')
+console.setFormatter(formatter)
+logging.getLogger('').addHandler(console)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Migrate a BandAssessment database to schema version " +
+                                                 str(Schema_Version) + ".")
+    parser.add_argument("database", nargs="?", default=SQL3Handler.Database_Name,
+                        help="the sqlite3 database file")
+    args = parser.parse_args()
+    if migrate_database(args.database):
+        print("Database is at schema version " + str(Schema_Version) + ".")
+    else:
+        print("Database migration failed, see the log.")
+
+
+if __name__ == '__main__':
+    main()
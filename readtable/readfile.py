@@ -1,51 +1,105 @@
+import mmap
 import struct
 import logging
 
+# the compiled formats of the single values
+Int_Struct = struct.Struct("i")
+Float_Struct = struct.Struct("f")
+Long_Float_Struct = struct.Struct("d")
+Byte_Struct = struct.Struct("B")
+
 
 class TableFile:
-    def __init__(self, name):
+    """
+    The whole table file is read into one buffer, or memory mapped, when it is opened.
+    The values are then decoded from the buffer at CurrentByteCount.
+    """
+
+    def __init__(self, name, use_mmap=False):
+        """
+        :param name: table file name including path
+        :param use_mmap: memory map the file instead of reading it
+        """
+        self.Name = name
         self.CurrentByteCount = 0
-        self.IntSize = 4
-        self.FloatSize = 4
-        self.ByteSize = 1
-        self.LongFloatSize = 8
+        self.IntSize = Int_Struct.size
+        self.FloatSize = Float_Struct.size
+        self.ByteSize = Byte_Struct.size
+        self.LongFloatSize = Long_Float_Struct.size
+        self.Buffer = None
         try:
             self.FP = open(name, 'rb')
         except Exception as e:
             logging.error(str(e))
             self.FP = False
+            return
+        try:
+            if use_mmap:
+                self.Buffer = mmap.mmap(self.FP.fileno(), 0, access=mmap.ACCESS_READ)
+            else:
+                self.Buffer = self.FP.read()
+        except Exception as e:
+            logging.error(str(e))
+            # e.g. an empty file can not be memory mapped
+            self.FP.close()
+            self.FP = False
 
-    def readint(self):
+    def readstruct(self, compiled: struct.Struct):
+        """
+        Decode a block of values at once.
+        :param compiled: a struct.Struct of the block
+        :return: a tuple of the values
+        """
         if self.FP is not False:
-            self.CurrentByteCount += self.IntSize
-            return struct.unpack("i", self.FP.read(self.IntSize))[0]
+            values = compiled.unpack_from(self.Buffer, self.CurrentByteCount)
+            self.CurrentByteCount += compiled.size
+            return values
         else:
             logging.error("File is not opened correctly.")
 
+    def __read_one(self, compiled: struct.Struct):
+        values = self.readstruct(compiled)
+        if values is not None:
+            return values[0]
+
+    def readint(self):
+        return self.__read_one(Int_Struct)
+
     def readfloat(self):
-        if self.FP is not False:
-            self.CurrentByteCount += self.FloatSize
-            return struct.unpack("f", self.FP.read(self.FloatSize))[0]
-        else:
-            logging.error("File is not opened correctly.")
+        return self.__read_one(Float_Struct)
 
     def readlongfloat(self):
-        if self.FP is not False:
-            self.CurrentByteCount += self.LongFloatSize
-            return struct.unpack("d", self.FP.read(self.LongFloatSize))[0]
-        else:
-            logging.error("File is not opened correctly.")
+        return self.__read_one(Long_Float_Struct)
 
     def readbyte(self):
+        return self.__read_one(Byte_Struct)
+
+    def readbytes(self, size):
+        """
+        :param size: number of bytes
+        :return: a memoryview of the bytes, it is not copied.
+        Release it before close if the file is memory mapped.
+        """
         if self.FP is not False:
-            self.CurrentByteCount += self.ByteSize
-            return struct.unpack("B", self.FP.read(self.ByteSize))[0]
+            if size < 0:
+                raise ValueError("Read a negative number of bytes.")
+            if self.CurrentByteCount + size > len(self.Buffer):
+                raise ValueError("Read beyond the end of the file.")
+            view = memoryview(self.Buffer)[self.CurrentByteCount:self.CurrentByteCount + size]
+            self.CurrentByteCount += size
+            return view
         else:
             logging.error("File is not opened correctly.")
 
     # noinspection PyUnresolvedReferences
     def close(self):
-        self.FP.close()
+        try:
+            if isinstance(self.Buffer, mmap.mmap):
+                self.Buffer.close()
+        finally:
+            self.Buffer = None
+            if self.FP is not False:
+                self.FP.close()
 
 
 if __name__ == '__main__':
@@ -1,7 +1,15 @@
+import struct
 import logging
+from collections import OrderedDict
 import numpy as np
 from readtable.readfile import TableFile
 
+# TableVersion, TableContentState, TableLength, PrivateHdrOffset, DataOffset,
+# DataLength, LastUpdateTime, TableContentVersion, DataType, DataArrangement
+Public_Header = struct.Struct("10i")
+# Channels, Slices, PhiFfs, ZFfs, Integrators, Segments, SliceWidthDet, AirTypes, ScaledDose
+Private_Header = struct.Struct("8if")
+
 
 class TableData:
     TableTypeDict = {
@@ -11,6 +19,11 @@ class TableData:
         -1: "Unkown"
     }
 
+    # the max number of fused and simplized tables kept by the cache
+    Cache_Size = 32
+    # the axes of View
+    Axis_Names = ("channels", "segments", "zffs", "phiffs", "integrators", "slices")
+
     DMSTypeDict = {
         # channels : (DMS name, channel per module)
         768: ("P07A/B", 32),
@@ -18,9 +31,16 @@ class TableData:
         -1:  ("Unkown", 16)
     }
 
-    def __init__(self, name):
+    def __init__(self, name, memmap=False):
+        """
+        :param name: table file name including path
+        :param memmap: keep the data as float32 memory map of the file, only the
+        headers and the accessed part are read. Else the data is loaded as float64.
+        """
         self.isFileAnalyzeComplete = False
-        self.File = TableFile(name)
+        self.MemoryMap = memmap
+        self.__cache = OrderedDict()
+        self.File = TableFile(name, use_mmap=memmap)
         if self.File.FP is False:
             logging.error("Read File error!")
             return
@@ -29,75 +49,97 @@ class TableData:
             self.__read_pri_header()
             self.__init_data()
             self.__read_data()
-            self.File.close()
         except Exception as e:
             logging.error(str(e))
             logging.error("File not correctly initilized. " +
                           "Make sure upload the corect table file!")
             return
+        finally:
+            self.File.close()
         self.isFileAnalyzeComplete = True
         self.__init_header_dict()
 
     def __read_pub_header(self):
-        self.TableVersion = self.File.readint()
-        self.TableContentState = self.File.readint()
+        (self.TableVersion,
+         self.TableContentState,
+         self.TableLenth,
+         self.PrivateHdrOffset,
+         self.DataOffset,
+         self.DataLength,
+         self.LastUpdateTime,
+         # TODO
+         # self.PubLastUpdateTimeStr =
+         # datestr(datenum(LastUpdateTime/60/60/24)+
+         # datenum('01-Jan-1970 8:00:00'));
+         self.TableContentVersion,
+         self.DataType,
+         self.DataArrangement) = self.File.readstruct(Public_Header)
         if self.TableContentState in self.TableTypeDict:
             self.TableType = self.TableTypeDict[self.TableContentState]
         else:
             self.TableType = self.TableTypeDict[-1]
-        self.TableLenth = self.File.readint()
-        self.PrivateHdrOffset = self.File.readint()
-        self.DataOffset = self.File.readint()
-        self.DataLength = self.File.readint()
-        self.LastUpdateTime = self.File.readint()
-        # TODO
-        # self.PubLastUpdateTimeStr =
-        # datestr(datenum(LastUpdateTime/60/60/24)+
-        # datenum('01-Jan-1970 8:00:00'));
-        self.TableContentVersion = self.File.readint()
-        self.DataType = self.File.readint()
-        self.DataArrangement = self.File.readint()
 
     def __read_pri_header(self):
         if self.File.CurrentByteCount != self.PrivateHdrOffset:
             logging.error("Private header start position wrong!")
             return
-        self.Channels = self.File.readint()
+        (self.Channels,
+         self.Slices,
+         self.PhiFfs,
+         self.ZFfs,
+         self.Integrators,
+         self.Segments,
+         self.SliceWidthDet,
+         self.AirTypes,
+         # TODO
+         # Not Right type!!!
+         self.ScaledDose) = self.File.readstruct(Private_Header)
         if self.Channels in self.DMSTypeDict:
             self.DMSType = self.DMSTypeDict[self.Channels]
         else:
             self.DMSType = self.DMSTypeDict[-1]
-        self.Slices = self.File.readint()
-        self.PhiFfs = self.File.readint()
-        self.ZFfs = self.File.readint()
-        self.Integrators = self.File.readint()
-        self.Segments = self.File.readint()
-        self.SliceWidthDet = self.File.readint()
-        self.AirTypes = self.File.readint()
-        # TODO
-        # Not Right type!!!
-        self.ScaledDose = self.File.readfloat()
         logging.warning("Known Bug, the scaled dose is not correct!")
 
     def __init_data(self):
         offset = self.DataOffset-self.File.CurrentByteCount
-        self.UnknownData = []
-        for _ in range(0, offset):
-            self.UnknownData.append(self.File.readbyte())
+        unknown = self.File.readbytes(offset)
+        self.UnknownData = list(unknown)
+        unknown.release()
 
         self.Rows = self.Channels
         self.Cols = self.Segments * self.ZFfs * \
-            self.ZFfs * self.Integrators * \
+            self.PhiFfs * self.Integrators * \
             self.Slices
-        self.Data = np.zeros([self.Rows, self.Cols])
+        # DataLength is checked as number of values or as number of bytes
+        if self.DataLength not in (self.Rows * self.Cols, self.Rows * self.Cols * self.File.FloatSize):
+            logging.warning("Data length %d does not match %d channels x %d columns!" %
+                            (self.DataLength, self.Rows, self.Cols))
 
     def __read_data(self):
         if self.File.CurrentByteCount != self.DataOffset:
             logging.error("Data start position wrong!")
+            self.Data = np.zeros([self.Rows, self.Cols])
             return
-        for i in range(0, self.Cols):
-            for j in range(0, self.Rows):
-                self.Data[j, i] = self.File.readfloat()
+        # the data is stored column by column
+        if self.MemoryMap:
+            self.Data = np.memmap(self.File.Name, dtype=np.float32, mode="r",
+                                  offset=self.DataOffset, shape=(self.Rows, self.Cols), order="F")
+        else:
+            self.Data = np.frombuffer(self.File.Buffer, dtype=np.float32,
+                                      count=self.Rows * self.Cols, offset=self.DataOffset). \
+                reshape((self.Rows, self.Cols), order="F").astype(np.float64)
+        self.__init_view()
+
+    def __init_view(self):
+        """
+        View the data as (channels, segments, zffs, phiffs, integrators, slices), see Axis_Names.
+        The columns are ordered as segment, zffs, phiffs, integrator, slice,
+        so the column axis is split without copy.
+        """
+        self.View = self.Data.reshape((self.Rows, self.Segments, self.ZFfs,
+                                       self.PhiFfs, self.Integrators, self.Slices))
+        if not np.shares_memory(self.View, self.Data):
+            raise ValueError("Data view is not sharing memory with data.")
 
     def __init_header_dict(self):
         if self.isFileAnalyzeComplete is False:
@@ -139,76 +181,99 @@ class TableData:
             logging.error("Index out of boundary during fetch data")
             return False
 
-        segment -= 1
-        zffs -= 1
-        phiffs -= 1
-        integrator -= 1
-
-        seg_offset = self.ZFfs * self.PhiFfs * self.Integrators * self.Slices
-        z_offset = self.PhiFfs * self.Integrators * self.Slices
-        phi_offset = self.Integrators * self.Slices
-        int_offset = self.Slices
-        start_col = (seg_offset * segment +
-                     z_offset * zffs +
-                     phi_offset * phiffs +
-                     int_offset * integrator)
-        end_col = start_col + self.Slices
-        return self.Data[:, start_col:end_col]
-
-    def fusedata(self):
+        return self.View[:, segment - 1, zffs - 1, phiffs - 1, integrator - 1, :]
+
+    def __cached(self, key, calculate):
+        """
+        Get a result from the cache, or calculate and store it.
+        The least recently used result is dropped if the cache is full.
+        :param key: a hashable key of the result
+        :param calculate: a function without parameter to calculate the result
+        :return: the result, np arrays are read only as they are shared
+        """
+        if key in self.__cache:
+            self.__cache.move_to_end(key)
+            return self.__cache[key]
+        result = calculate()
+        if not isinstance(result, np.ndarray):
+            # errors are not cached
+            return result
+        result.flags.writeable = False
+        self.__cache[key] = result
+        while len(self.__cache) > self.Cache_Size:
+            self.__cache.popitem(last=False)
+        return result
+
+    def clear_cache(self):
+        self.__cache.clear()
+
+    @staticmethod
+    def __selection_key(*selections):
+        """
+        :return: the selections of fusedata as hashable tuple
+        """
+        return tuple(None if selection is None else
+                     tuple(int(x) for x in np.atleast_1d(selection))
+                     for selection in selections)
+
+    def fusedata(self, segments=None, zffs=None, phiffs=None, integrators=None):
+        """
+        Average the data over segments, zffs, phiffs and integrators.
+        Each selection is None for all, one number or a list of numbers starting from 1,
+        e.g. zffs=2 to average zFFS 2 only with all the others.
+        The result is cached and read only.
+        :return: np array with shape (channels, slices)
+        """
         if self.isFileAnalyzeComplete is False:
             logging.error("Data not initialized!")
             return False
-        # Start calculating
-        data = np.zeros([self.Channels, self.Slices])
-        logging.info("Raw data initilized, shape is: %s" %
-                     (str(data.shape)))
-        count = 0
-        for seg in range(1, self.Segments+1):
-            for zff in range(1, self.ZFfs+1):
-                for pff in range(1, self.PhiFfs+1):
-                    for inte in range(1, self.Integrators+1):
-                        data += self.getdata(segment=seg, zffs=zff,
-                                             phiffs=pff, integrator=inte)
-                        count += 1
-        return data/count
-
-    def simplize_table(self, module_sep=2, slice_sep=2):
+        key = ("fuse",) + self.__selection_key(segments, zffs, phiffs, integrators)
+        return self.__cached(key, lambda: self.__fusedata(segments, zffs, phiffs, integrators))
+
+    def __fusedata(self, segments, zffs, phiffs, integrators):
+        data = self.View
+        for axis, selection, size in ((1, segments, self.Segments),
+                                      (2, zffs, self.ZFfs),
+                                      (3, phiffs, self.PhiFfs),
+                                      (4, integrators, self.Integrators)):
+            if selection is None:
+                continue
+            index = np.atleast_1d(np.asarray(selection, dtype=np.intp)) - 1
+            if index.size == 0 or index.min() < 0 or index.max() >= size:
+                logging.error("Index out of boundary during fuse data")
+                return False
+            data = np.take(data, index, axis=axis)
+        logging.info("Fuse data of shape: %s" % (str(data.shape),))
+        return data.mean(axis=(1, 2, 3, 4), dtype=np.float64)
+
+    def simplize_table(self, module_sep=2, slice_sep=2,
+                       segments=None, zffs=None, phiffs=None, integrators=None):
+        """
+        Average the fused data over groups of channels and slices.
+        :param module_sep: number of channel groups per module
+        :param slice_sep: number of slice groups
+        :param segments: see fusedata, also zffs, phiffs and integrators
+        :return: np array with shape (channel groups, slice_sep). It is cached and read only.
+        """
+        key = ("simplize", module_sep, slice_sep) + \
+            self.__selection_key(segments, zffs, phiffs, integrators)
+        return self.__cached(key, lambda: self.__simplize_table(module_sep, slice_sep,
+                                                                segments, zffs, phiffs, integrators))
+
+    def __simplize_table(self, module_sep, slice_sep, segments, zffs, phiffs, integrators):
         # get fused data
         logging.info("Simplizing Data: module sep: %d; slices fuse: %d" %
                      (module_sep, slice_sep))
-        data = self.fusedata()
+        data = self.fusedata(segments, zffs, phiffs, integrators)
         # 计算每份通道和层厚里由多少数据整合
         mod = int(self.DMSTypeDict[self.Channels][1]/module_sep)
         sli = int(self.Slices / slice_sep)
         # 计算层厚数据
-        fuse_slice = np.zeros([int(self.Channels), slice_sep])
-        temp = 0
-        for i in range(0, self.Channels):
-            fus_count = 0
-            for j in range(0, self.Slices):
-                if j % sli == (sli - 1) and j != 0:
-                    temp += data[i, j]
-                    fuse_slice[i, fus_count] = temp / sli
-                    fus_count += 1
-                    temp = 0
-                else:
-                    temp += data[i, j]
+        fuse_slice = _group_mean(data, sli, slice_sep)
         logging.info("Simplize slices Done. Shape is: %s" %
                      (str(fuse_slice.shape),))
-        # 计算通道数据
-        simple = np.zeros([int(self.Channels / mod), slice_sep])
-        temp = 0
-        for j in range(0, fuse_slice.shape[1]):
-            sim_count = 0
-            for i in range(0, fuse_slice.shape[0]):
-                if i % mod == (mod - 1) and i != 0:
-                    temp += fuse_slice[i, j]
-                    simple[sim_count, j] = temp / mod
-                    sim_count += 1
-                    temp = 0
-                else:
-                    temp += fuse_slice[i, j]
+        # 计算通道数据, the groups run along the channels of each column
+        simple = _group_mean(fuse_slice.T, mod, int(self.Channels / mod)).T
         logging.info("Simplize Channel Done. Shape is: %s" %
                      (str(simple.shape),))
         return simple
@@ -218,37 +283,18 @@ class TableData:
         mod_chan = self.DMSTypeDict[self.Channels][1]
         data = self.simplize_table(module_sep=mod_chan, slice_sep=fus_slice)
 
-        result = np.zeros([int(self.Channels/mod_chan) * 2, data.shape[1]])
-        for j in range(0, data.shape[1]):
-            count = 0
-            for i in range(0, data.shape[0]):
-                if i % mod_chan == 0 or i % mod_chan == (mod_chan-1):
-                    result[count, j] = data[i, j]
-                    count += 1
-
-        channel = np.zeros([int(result.shape[0]/2)-1, result.shape[1]])
-        for j in range(0, result.shape[1]):
-            count = 0
-            for i in range(0, result.shape[0]):
-                if i % 2 == 0 and i != 0:
-                    channel[count, j] = result[i, j] - result[i-1, j]
-                    count += 1
+        # the first and the last channel of each module
+        position = np.arange(data.shape[0]) % mod_chan
+        result = data[(position == 0) | (position == mod_chan - 1)]
+        # the gap between the last channel of a module and the first of the next one
+        channel = result[2::2] - result[1:-1:2]
         logging.info("sort channel done!")
         return channel
 
     def sort_nearest_neighbor(self, fus_slice=1):
         logging.info("sort nearest neighbor start!")
         data = self.simplize_table(module_sep=1, slice_sep=fus_slice)
-        mod_chan = self.DMSTypeDict[self.Channels][1]
-        mod = int(self.Channels/mod_chan)
-        result = np.zeros([mod - 1,
-                           data.shape[1]])
-        for j in range(0, data.shape[1]):
-            count = 0
-            for i in range(0, data.shape[0]):
-                if i != 0:
-                    result[count, j] = data[i, j] - data[i - 1, j]
-                    count += 1
+        result = np.diff(data, axis=0)
         logging.info("sort nearest neighbor done!")
         return result
 
@@ -274,15 +320,9 @@ class TableData:
             logging.warning("Unkown DMS type, suppose not partial fan DMS")
             middle = (int(mod/2), int(mod/2+1))
 
-        result = np.zeros([mod, data.shape[1]])
-        for j in range(0, data.shape[1]):
-            for i in range(0, data.shape[0]):
-                # left part
-                if i < middle[1]:
-                    result[i, j] = data[i, j] - data[middle[0], j]
-                # right part
-                else:
-                    result[i, j] = data[i, j] - data[middle[1], j]
+        # left part minus the left middle module, right part minus the right one
+        left = np.arange(data.shape[0]) < middle[1]
+        result = data - np.where(left[:, np.newaxis], data[middle[0]], data[middle[1]])
         logging.info("sort center done!")
         return result
 
@@ -320,22 +360,20 @@ class TableData:
             is_partial_fan = False
 
         # mirror calculating
+        i = np.arange(result_half_len)
         if is_partial_fan is True:
-            for j in range(0, data.shape[1]):
-                for i in range(0, result_half_len):
-                    # left part
-                    result[result_half_len - i - 1, j] = data[middle[0] - i, j] - data[middle[1] + i, j]
-                    # right part
-                    if result[result_half_len - i - 1, j] != 0:
-                        result[result_half_len + i - 1, j] = result[result_half_len - i - 1, j]
+            mirror = data[middle[0] - i] - data[middle[1] + i]
+            # left part
+            result[result_half_len - i - 1] = mirror
+            # right part, the middle module is shared and zero is not copied
+            result[result_half_len:] = np.where(mirror[1:] != 0, mirror[1:], 0.0)
 
         if is_partial_fan is False:
-            for j in range(0, data.shape[1]):
-                for i in range(0, result_half_len):
-                    # left part
-                    result[result_half_len - i - 1, j] = data[middle[0] - i - 1, j] - data[middle[1] + i - 1, j]
-                    # right part
-                    result[result_half_len + i, j] = result[result_half_len - i - 1, j]
+            mirror = data[middle[0] - i - 1] - data[middle[1] + i - 1]
+            # left part
+            result[result_half_len - i - 1] = mirror
+            # right part
+            result[result_half_len + i] = mirror
 
         # TODO
         # the result len is not total module, should add 0 to fill
@@ -344,5 +382,44 @@ class TableData:
         return result
 
 
+def _group_mean(data, group, groups):
+    """
+    Average each group of values along the rows of data, as the original loop did:
+    the values are summed row after row, and a group is closed at each column j
+    with j % group == group - 1 and j != 0. The sum is not reset at the end of a row,
+    and the values after the last closed group are dropped.
+    :param data: 2D np array
+    :param group: number of values in one group
+    :param groups: number of groups per row in the result
+    :return: np array with shape (rows, groups), zero where no group is closed
+    """
+    rows, cols = data.shape
+    result = np.zeros([rows, groups])
+    if group == 0:
+        raise ZeroDivisionError("integer division or modulo by zero")
+    j = np.arange(cols)
+    closing = (j % group == group - 1) & (j != 0)
+    # the positions of the closed groups in the data read row after row
+    ends = np.flatnonzero(np.tile(closing, rows))
+    if ends.size == 0:
+        return result
+    starts = np.concatenate(([0], ends[:-1] + 1))
+    # sum the k-th value of all groups at once, in the same order as the original loop,
+    # so the result is identical to it
+    values = data.reshape(-1)
+    lengths = ends - starts + 1
+    sums = np.zeros(ends.size)
+    for k in range(lengths.max()):
+        valid = lengths > k
+        np.add(sums, values[np.minimum(starts + k, ends)], out=sums, where=valid)
+    row = ends // cols
+    # the number of groups closed before in the same row
+    rank = np.arange(ends.size) - np.searchsorted(ends, row * cols)
+    if rank.max() >= groups:
+        raise IndexError("index %d is out of bounds for axis 1 with size %d" % (rank.max(), groups))
+    result[row, rank] = sums / group
+    return result
+
+
 if __name__ == '__main__':
     print("Please don't use it individually.")
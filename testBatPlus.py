@@ -1,48 +1,95 @@
 from bat.DatabaseHandler import SQL3Handler
+from bat.DatabaseHandler import SQL3Writer
 from bat.DirectoryHandler import DirectoryHandler
-from bat.ImageHandler import ImageHandler
+from bat.BatchPipeline import BatchPipeline
+from bat.IndexHandler import ScanIndexHandler
+import argparse
 import logging
-import sys
 
-logging.basicConfig(level=logging.DEBUG,
-                    format='%(asctime)s %(filename)s[line:%(lineno)d] %(levelname)s %(message)s',
-                    datefmt='%a, %d %b %Y %H:%M:%S',
-                    filename=r'./BatPlus.log',
-                    filemode='w')
-# define a stream that will show log level > ERROR on screen also
-console = logging.StreamHandler()
-console.setLevel(logging.WARNING)
-formatter = logging.Formatter('%(levelname)-8s %(message)s')
-console.setFormatter(formatter)
-logging.getLogger('').addHandler(console)
+
+def setup_logging():
+    """
+    Configure the log file and console. It is called by main only, so a worker
+    process which imports this module again (spawn) does not truncate the log file.
+    """
+    logging.basicConfig(level=logging.DEBUG,
+                        format='%(asctime)s %(filename)s[line:%(lineno)d] %(levelname)s %(message)s',
+                        datefmt='%a, %d %b %Y %H:%M:%S',
+                        filename=r'./BatPlus.log',
+                        filemode='w')
+    # define a stream that will show log level > ERROR on screen also
+    console = logging.StreamHandler()
+    console.setLevel(logging.WARNING)
+    formatter = logging.Formatter('%(levelname)-8s %(message)s')
+    console.setFormatter(formatter)
+    logging.getLogger('').addHandler(console)
 
 
 def main():
-    if len(sys.argv) == 1:
-        files = DirectoryHandler(r'.\test')
-    elif len(sys.argv) == 2:
-        files = DirectoryHandler(sys.argv[1])
+    setup_logging()
+    parser = argparse.ArgumentParser(description="Analyze all Band Assessment images in a folder.")
+    parser.add_argument("directory", nargs="?", default=r'.\test',
+                        help="the folder to search dicom files in")
+    parser.add_argument("--jobs", type=int, default=1,
+                        help="number of worker processes")
+    parser.add_argument("--rerun", action="store_true",
+                        help="analyze all files again and replace their stored results")
+    parser.add_argument("--batch-size", type=int, default=500,
+                        help="number of records stored in one transaction")
+    parser.add_argument("--readers", type=int, default=4,
+                        help="number of threads to read the files")
+    args = parser.parse_args()
+
+    index = ScanIndexHandler()
+    # the files of the last scan of the folder, the folder is scanned again during the run
+    if args.rerun:
+        statuses = (ScanIndexHandler.Status_New, ScanIndexHandler.Status_Failed,
+                    ScanIndexHandler.Status_Done)
+    else:
+        statuses = (ScanIndexHandler.Status_New, ScanIndexHandler.Status_Failed)
+    total = index.count(args.directory, statuses) or None
+    if args.rerun:
+        files = DirectoryHandler(args.directory, index=index, scan=False)
     else:
-        print("programe paramters confused!")
-        return 1
+        # skip the stored images and the files done by an interrupted run,
+        # before their pixel data is read
+        files = DirectoryHandler(args.directory, index=index, scan=False,
+                                 known_uids=SQL3Handler.stored_uids(), resume=True)
     print("Program is finding dicom files...")
-    count = 1
-    for _file in files.Dicom_File_Path:
-        sys.stdout.write(f"\r{count:d}/{files.Total_Dicom_Quantity:d}: ")
-        _image = ImageHandler(_file, window=(70, -5))
-        count += 1
-        if _image.isImageComplete:
-            _image.save_image()
-            if _image.Kernel == "Hr40f" and (_image.OriginalCollimation == 16 or
-                                             _image.OriginalCollimation == 1 or
-                                             _image.OriginalCollimation == 32 or
-                                             _image.OriginalCollimation == 64):
-                _image.draw_sorted_iq_result(100, 2)
-            if _image.Kernel == "Br40f" and ((_image.OriginalCollimation == 16 or
-                                              _image.OriginalCollimation == 32) and
-                                             _image.KVP == 130):
-                _image.draw_sorted_iq_result(100, 2)
-            SQL3Handler(_image).insert_data()
+    pipeline = BatchPipeline(jobs=args.jobs, readers=args.readers, window=(70, -5),
+                             batch_size=args.batch_size, total=total)
+    writer = SQL3Writer(batch_size=args.batch_size, replace=args.rerun)
+    if not writer.isComplete:
+        print("Database can not be opened, see the log.")
+        index.close()
+        return
+
+    def store(records):
+        stored = True
+        for record in records:
+            if record.isImageComplete and writer.add(record) is None:
+                stored = False
+        if writer.flush() is None:
+            stored = False
+        for record in records:
+            if not record.isImageComplete:
+                logging.warning(str(record.FileName) + " failed: " + str(record.Error))
+                index.set_status(record.FileName, ScanIndexHandler.Status_Failed)
+            elif stored:
+                # the files are marked done only after their records are stored
+                index.set_status(record.FileName, ScanIndexHandler.Status_Done)
+        if not stored:
+            logging.error(str(len(records)) + r" records are not stored, "
+                                              r"they are analyzed again on the next run.")
+        index.commit()
+
+    # the analysis starts as soon as the 1st file is found
+    pipeline.run((_file for _file, _ in files.iter_files()), store)
+    writer.close()
+    index.close()
+    logging.info(str(files.Skipped_Quantity) + r" files are skipped as already stored.")
+    # summed over the worker processes, the cache of this process is not used with --jobs > 1
+    logging.info(r"Geometry cache: " + str(pipeline.GeometryCounters))
     print("Program exits sucesfully.")
 
 
@@ -0,0 +1,229 @@
+"""
+The loops of the original code, kept as reference for the vectorized versions.
+"""
+import numpy as np
+
+
+def bresenham(image, center, radius):
+    """
+    :return: a tuple as (sum, count) of the bresenham circle, as ImageHandler.bresenham did
+    """
+    x = 0
+    y = radius
+    d = 3 - 2 * radius
+    count = 0
+    integration_result = 0.0
+    while x < y:
+        integration_result += image[center[0] - y, center[1] + x]
+        integration_result += image[center[0] + y, center[1] + x]
+        integration_result += image[center[0] - y, center[1] - x]
+        integration_result += image[center[0] + y, center[1] - x]
+        integration_result += image[center[0] - x, center[1] + y]
+        integration_result += image[center[0] - x, center[1] - y]
+        integration_result += image[center[0] + x, center[1] + y]
+        integration_result += image[center[0] + x, center[1] - y]
+        count += 8
+        if d < 0:
+            d = d + 4 * x + 6
+        else:
+            d = d + 4 * (x - y) + 10
+            y -= 1
+        x += 1
+    return integration_result, count
+
+
+def integration(image, center, max_radius, width=8):
+    """
+    :return: a tuple as (integration result, median filter result)
+    """
+    integration_result = np.zeros(max_radius)
+    median_result = np.zeros(max_radius)
+    for index in range(1, max_radius):
+        result = bresenham(image, center, index)
+        integration_result[index] = result[0] / result[1]
+    for index in range(max_radius - width):
+        median_result[index] = np.median(integration_result[index:index + width])
+    return integration_result, median_result
+
+
+def roi_measure(image, center, radius):
+    result_hu = 0
+    result_count = 0
+    for index in range(1, radius):
+        _result = bresenham(image, center, index)
+        result_hu += _result[0]
+        result_count += _result[1]
+    return result_hu / result_count
+
+
+def find_center_roi_min(image, center, radius, deviation):
+    """
+    :return: a tuple as (min result, min position)
+    """
+    result_min = roi_measure(image, center, 10)
+    min_row = center[0]
+    min_col = center[1]
+    for index_row in range(center[0] - deviation, center[0] + deviation):
+        for index_col in range(center[1] - deviation, center[1] + deviation):
+            result = roi_measure(image, (index_row, index_col), radius)
+            if result < result_min:
+                result_min = result
+                min_row = index_row
+                min_col = index_col
+    return result_min, (min_row, min_col)
+
+
+def circular_bresenham(image, center, radius, radius_inner):
+    """
+    :return: a tuple as (list of ROI mean values, list of positions)
+    """
+    x = 0
+    y = radius
+    d = 3 - 2 * radius
+    circular_result = []
+    circular_pos = []
+    while x < y:
+        for row, col in ((center[0] - y, center[1] + x), (center[0] + y, center[1] + x),
+                         (center[0] - y, center[1] - x), (center[0] + y, center[1] - x),
+                         (center[0] - x, center[1] + y), (center[0] - x, center[1] - y),
+                         (center[0] + x, center[1] + y), (center[0] + x, center[1] - y)):
+            circular_result.append(roi_measure(image, (row, col), radius_inner))
+            circular_pos.append((row, col))
+        if d < 0:
+            d = d + 4 * x + 6
+        else:
+            d = d + 4 * (x - y) + 10
+            y -= 1
+        x += 1
+    return circular_result, circular_pos
+
+
+def fusedata(table):
+    """
+    :return: the average over segments, zffs, phiffs and integrators, as TableData.fusedata did
+    """
+    data = np.zeros([table.Channels, table.Slices])
+    count = 0
+    for seg in range(1, table.Segments + 1):
+        for zff in range(1, table.ZFfs + 1):
+            for pff in range(1, table.PhiFfs + 1):
+                for inte in range(1, table.Integrators + 1):
+                    data += table.getdata(segment=seg, zffs=zff, phiffs=pff, integrator=inte)
+                    count += 1
+    return data / count
+
+
+def simplize_table(table, module_sep=2, slice_sep=2):
+    """
+    :return: the fused data of the table averaged over groups, as TableData.simplize_table did
+    """
+    data = table.fusedata()
+    mod = int(table.DMSTypeDict[table.Channels][1] / module_sep)
+    sli = int(table.Slices / slice_sep)
+    fuse_slice = np.zeros([int(table.Channels), slice_sep])
+    temp = 0
+    for i in range(0, table.Channels):
+        fus_count = 0
+        for j in range(0, table.Slices):
+            if j % sli == (sli - 1) and j != 0:
+                temp += data[i, j]
+                fuse_slice[i, fus_count] = temp / sli
+                fus_count += 1
+                temp = 0
+            else:
+                temp += data[i, j]
+    simple = np.zeros([int(table.Channels / mod), slice_sep])
+    temp = 0
+    for j in range(0, fuse_slice.shape[1]):
+        sim_count = 0
+        for i in range(0, fuse_slice.shape[0]):
+            if i % mod == (mod - 1) and i != 0:
+                temp += fuse_slice[i, j]
+                simple[sim_count, j] = temp / mod
+                sim_count += 1
+                temp = 0
+            else:
+                temp += fuse_slice[i, j]
+    return simple
+
+
+def sort_channel(table, fus_slice=1):
+    mod_chan = table.DMSTypeDict[table.Channels][1]
+    data = table.simplize_table(module_sep=mod_chan, slice_sep=fus_slice)
+    result = np.zeros([int(table.Channels / mod_chan) * 2, data.shape[1]])
+    for j in range(0, data.shape[1]):
+        count = 0
+        for i in range(0, data.shape[0]):
+            if i % mod_chan == 0 or i % mod_chan == (mod_chan - 1):
+                result[count, j] = data[i, j]
+                count += 1
+    channel = np.zeros([int(result.shape[0] / 2) - 1, result.shape[1]])
+    for j in range(0, result.shape[1]):
+        count = 0
+        for i in range(0, result.shape[0]):
+            if i % 2 == 0 and i != 0:
+                channel[count, j] = result[i, j] - result[i - 1, j]
+                count += 1
+    return channel
+
+
+def sort_nearest_neighbor(table, fus_slice=1):
+    data = table.simplize_table(module_sep=1, slice_sep=fus_slice)
+    mod = int(table.Channels / table.DMSTypeDict[table.Channels][1])
+    result = np.zeros([mod - 1, data.shape[1]])
+    for j in range(0, data.shape[1]):
+        count = 0
+        for i in range(0, data.shape[0]):
+            if i != 0:
+                result[count, j] = data[i, j] - data[i - 1, j]
+                count += 1
+    return result
+
+
+def _middle(table, mod):
+    """
+    :return: a tuple as (middle, is partial fan) of the DMS type of the table
+    """
+    if table.DMSType == table.DMSTypeDict[768]:
+        return (13, 13), True
+    if table.DMSType == table.DMSTypeDict[840]:
+        return (22, 23), False
+    return (int(mod / 2), int(mod / 2 + 1)), False
+
+
+def sort_center(table, fus_slice=1):
+    mod = int(table.Channels / table.DMSTypeDict[table.Channels][1])
+    data = table.simplize_table(module_sep=1, slice_sep=fus_slice)
+    middle, _ = _middle(table, mod)
+    result = np.zeros([mod, data.shape[1]])
+    for j in range(0, data.shape[1]):
+        for i in range(0, data.shape[0]):
+            if i < middle[1]:
+                result[i, j] = data[i, j] - data[middle[0], j]
+            else:
+                result[i, j] = data[i, j] - data[middle[1], j]
+    return result
+
+
+def sort_mirror(table, fus_slice=1):
+    mod = int(table.Channels / table.DMSTypeDict[table.Channels][1])
+    data = table.simplize_table(module_sep=1, slice_sep=fus_slice)
+    middle, is_partial_fan = _middle(table, mod)
+    if table.DMSType in (table.DMSTypeDict[768], table.DMSTypeDict[840]):
+        result_half_len = min(middle[0], mod - middle[1])
+    else:
+        result_half_len = int(mod / 2)
+    if is_partial_fan:
+        result = np.zeros([result_half_len * 2 - 1, data.shape[1]])
+        for j in range(0, data.shape[1]):
+            for i in range(0, result_half_len):
+                result[result_half_len - i - 1, j] = data[middle[0] - i, j] - data[middle[1] + i, j]
+                if result[result_half_len - i - 1, j] != 0:
+                    result[result_half_len + i - 1, j] = result[result_half_len - i - 1, j]
+    else:
+        result = np.zeros([result_half_len * 2, data.shape[1]])
+        for j in range(0, data.shape[1]):
+            for i in range(0, result_half_len):
+                result[result_half_len - i - 1, j] = data[middle[0] - i - 1, j] - data[middle[1] + i - 1, j]
+                result[result_half_len + i, j] = result[result_half_len - i - 1, j]
+    return result
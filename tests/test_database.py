@@ -0,0 +1,116 @@
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+from types import SimpleNamespace
+import numpy as np
+from bat.DatabaseHandler import encode_profile, decode_profile, migrate_database, schema_version, \
+    SQL3Writer, Schema_Version, Trend_Dtype
+
+# the table of schema 0, as the original SQL3Handler created it
+Create_Table_0 = '''create table BandAssessments(
+                       uid text primary key,
+                       modality text,
+                       serial_number integer,
+                       kvp real,
+                       current integer,
+                       kernel text,
+                       total_collimation real,
+                       slice_thickness real,
+                       slice_mode text,
+                       instance integer,
+                       integration_result text,
+                       comment text);'''
+
+
+def image_record(uid, profile, date_time="20180504112233.123456", instance=3):
+    """
+    :return: an object with the attributes stored by SQL3Writer
+    """
+    return SimpleNamespace(Uid=uid, Modality="CT", SerialNumber=80012, KVP=120.0, Current=200,
+                           Kernel="Hr40f", TotalCollimation=19.2, SliceThickness=1.2, TotalSlice=16,
+                           Instance=instance, Image_Median_Filter_Result=profile, DateTime=date_time)
+
+
+class DatabaseTest(unittest.TestCase):
+
+    def setUp(self):
+        self.Directory = tempfile.mkdtemp()
+        self.Database = os.path.join(self.Directory, "test.sqlite3.db")
+
+    def tearDown(self):
+        shutil.rmtree(self.Directory)
+
+    def trend(self, con):
+        """
+        :return: a tuple as (count, sum) of the only BandTrends row
+        """
+        rows = con.execute(r"select count, sum from BandTrends;").fetchall()
+        self.assertEqual(len(rows), 1)
+        return rows[0][0], np.frombuffer(rows[0][1], dtype=Trend_Dtype)
+
+    def test_profile_round_trip(self):
+        profile = np.random.RandomState(0).normal(0, 10, 233)
+        blob, dtype, length = encode_profile(profile)
+        self.assertEqual(len(blob), 4 * length)
+        decoded = decode_profile(blob, dtype, length)
+        np.testing.assert_array_equal(decoded, profile.astype(np.float32))
+        self.assertFalse(decoded.flags.writeable)
+        self.assertEqual(len(decode_profile(*encode_profile([]))), 0)
+
+    def test_migrate_text_profiles(self):
+        profiles = {"80012" + "20180504112233.123456" + "3": np.linspace(-5, 5, 50),
+                    "80012" + "20180505080000" + "4": np.linspace(0, 1, 50)}
+        con = sqlite3.connect(self.Database)
+        con.execute(Create_Table_0)
+        for instance, (uid, profile) in enumerate(sorted(profiles.items()), 3):
+            con.execute(r"insert into BandAssessments values (?,?,?,?,?,?,?,?,?,?,?,?);",
+                        (uid, "CT", 80012, 120.0, 200, "Hr40f", 19.2, 1.2, "16x1.2", instance,
+                         ",".join(str(x) for x in profile), "n.a."))
+        con.commit()
+        con.close()
+
+        self.assertTrue(migrate_database(self.Database))
+        con = sqlite3.connect(self.Database)
+        self.assertEqual(schema_version(con), Schema_Version)
+        rows = con.execute(r"select uid, integration_result, profile_dtype, profile_length, "
+                           r"acquisition_datetime from BandAssessments order by uid;").fetchall()
+        self.assertEqual([row[4] for row in rows], ["20180504112233.123456", "20180505080000"])
+        for uid, blob, dtype, length, _ in rows:
+            np.testing.assert_array_equal(decode_profile(blob, dtype, length),
+                                          profiles[uid].astype(np.float32))
+        # both images are in the bucket of May 2018
+        count, total = self.trend(con)
+        con.close()
+        self.assertEqual(count, 2)
+        np.testing.assert_allclose(total, sum(p.astype(np.float32) for p in profiles.values()))
+        # a migrated database is not migrated again
+        self.assertTrue(migrate_database(self.Database))
+
+    def test_writer_skips_and_replaces(self):
+        first, second = np.full(20, 1.0), np.full(20, 5.0)
+        with SQL3Writer(self.Database) as writer:
+            writer.add(image_record("a", first))
+            writer.add(image_record("b", first))
+            self.assertEqual(writer.flush(), 2)
+            # a stored uid is ignored
+            writer.add(image_record("a", second))
+            self.assertEqual(writer.flush(), 0)
+        with SQL3Writer(self.Database, replace=True) as writer:
+            writer.add(image_record("a", second))
+            self.assertEqual(writer.flush(), 1)
+
+        con = sqlite3.connect(self.Database)
+        blob, dtype, length = con.execute(r"select integration_result, profile_dtype, profile_length "
+                                          r"from BandAssessments where uid = 'a';").fetchone()
+        np.testing.assert_array_equal(decode_profile(blob, dtype, length), second)
+        # the trend is calculated again from the stored images
+        count, total = self.trend(con)
+        con.close()
+        self.assertEqual(count, 2)
+        np.testing.assert_array_equal(total, first + second)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,50 @@
+import unittest
+import numpy as np
+from bat.ImageHandler import find_circle
+from bat.ImageMath import radial_profile
+
+
+def phantom_image(center, radius=200, size=(512, 512)):
+    """
+    :return: a HU image of a water phantom in air
+    """
+    rows, cols = np.mgrid[0:size[0], 0:size[1]]
+    inside = np.hypot(rows - center[0], cols - center[1]) < radius
+    return np.where(inside, 0.0, -1000.0)
+
+
+def profile_length(image, detect_center):
+    """
+    :return: the length of the integration result, as ImageHandler.integration
+    """
+    center, radius, _ = find_circle(image, image.shape, (0.5, 0.5), detect_center)
+    if not detect_center:
+        center = (image.shape[0] // 2, image.shape[1] // 2)
+    return radial_profile(image, center, radius[0]).shape[-1]
+
+
+class FindCircleTest(unittest.TestCase):
+
+    def test_centered_phantom(self):
+        image = phantom_image((256.3, 255.6))
+        self.assertEqual(profile_length(image, detect_center=False), 233)
+        self.assertEqual(profile_length(image, detect_center=True), 233)
+
+    def test_large_phantom(self):
+        image = phantom_image((256, 256), radius=255)
+        self.assertEqual(profile_length(image, detect_center=False), 220)
+        self.assertEqual(profile_length(image, detect_center=True), 220)
+
+    def test_deviated_phantom(self):
+        image = phantom_image((256, 300))
+        self.assertEqual(profile_length(image, detect_center=False), 233)
+        self.assertEqual(profile_length(image, detect_center=True), 50)
+
+    def test_phantom_not_found(self):
+        image = np.full((512, 512), -1000.0)
+        self.assertEqual(profile_length(image, detect_center=False), 233)
+        self.assertEqual(profile_length(image, detect_center=True), 50)
+
+
+if __name__ == '__main__':
+    unittest.main()
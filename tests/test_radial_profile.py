@@ -0,0 +1,46 @@
+import unittest
+import numpy as np
+from bat.ImageMath import radial_profile, median_filter
+import legacy_reference as legacy
+
+
+class RadialProfileTest(unittest.TestCase):
+
+    def test_bresenham_matches_loop(self):
+        random = np.random.RandomState(0)
+        image = random.normal(0, 50, (512, 512))
+        for center, max_radius in (((256, 256), 233), ((250, 270), 200), ((100, 400), 50)):
+            expected, expected_median = legacy.integration(image, center, max_radius)
+            profile = radial_profile(image, center, max_radius)
+            # only the summation order differs
+            np.testing.assert_allclose(profile, expected, rtol=1e-12, atol=1e-9)
+            np.testing.assert_allclose(median_filter(profile), expected_median, rtol=1e-12, atol=1e-9)
+
+    def test_bresenham_matches_loop_exactly_on_integers(self):
+        random = np.random.RandomState(1)
+        image = random.randint(-1000, 1000, (512, 512)).astype(np.float64)
+        expected, expected_median = legacy.integration(image, (256, 256), 233)
+        profile = radial_profile(image, (256, 256), 233)
+        np.testing.assert_array_equal(profile, expected)
+        np.testing.assert_array_equal(median_filter(profile), expected_median)
+
+    def test_stack_matches_single_images(self):
+        random = np.random.RandomState(2)
+        stack = random.normal(0, 50, (3, 256, 256))
+        profiles = radial_profile(stack, (128, 128), 100)
+        for image, profile in zip(stack, profiles):
+            np.testing.assert_array_equal(profile, radial_profile(image, (128, 128), 100))
+
+    def test_euclidean_counts_each_pixel_once(self):
+        image = np.ones((128, 128))
+        profile = radial_profile(image, (64, 64), 50, method="euclidean")
+        self.assertEqual(profile[0], 0)
+        np.testing.assert_array_equal(profile[1:], 1)
+
+    def test_unknown_method_raises(self):
+        with self.assertRaises(ValueError):
+            radial_profile(np.zeros((16, 16)), (8, 8), 4, method="unknown")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+import os
+import shutil
+import struct
+import tempfile
+import unittest
+import numpy as np
+from readtable.readtable import TableData
+import legacy_reference as legacy
+
+
+def write_table(name, channels, slices=16, phiffs=2, zffs=2, integrators=2, segments=2, seed=0):
+    """
+    Write a table file with random data, the headers are as TableData reads them.
+    """
+    random = np.random.RandomState(seed)
+    cols = segments * zffs * phiffs * integrators * slices
+    data = random.normal(1, 0.1, (channels, cols)).astype(np.float32)
+    private_offset = 40
+    data_offset = private_offset + 36 + 8
+    public = struct.pack("10i", 3, 7, data_offset + data.nbytes, private_offset, data_offset,
+                         data.size, 123456, 1, 1, 0)
+    private = struct.pack("8if", channels, slices, phiffs, zffs, integrators, segments, 12, 1, 0.5)
+    with open(name, "wb") as f:
+        f.write(public + private + bytes(8) + data.tobytes(order="F"))
+
+
+class TableDataTest(unittest.TestCase):
+
+    def setUp(self):
+        self.Directory = tempfile.mkdtemp()
+        self.Tables = []
+        for channels in (840, 768):
+            name = os.path.join(self.Directory, str(channels))
+            write_table(name, channels, seed=channels)
+            table = TableData(name)
+            self.assertTrue(table.isFileAnalyzeComplete)
+            self.Tables.append(table)
+
+    def tearDown(self):
+        shutil.rmtree(self.Directory)
+
+    def test_fusedata_matches_loop(self):
+        for table in self.Tables:
+            # only the summation order differs
+            np.testing.assert_allclose(table.fusedata(), legacy.fusedata(table), rtol=1e-12)
+
+    def test_simplize_table_matches_loop(self):
+        for table in self.Tables:
+            for module_sep, slice_sep in ((1, 1), (2, 2), (4, 2), (20, 4), (1, 4), (3, 3)):
+                np.testing.assert_array_equal(table.simplize_table(module_sep, slice_sep),
+                                              legacy.simplize_table(table, module_sep, slice_sep))
+
+    def test_sort_matches_loop(self):
+        for table in self.Tables:
+            for fus_slice in (1, 2):
+                for name in ("sort_channel", "sort_nearest_neighbor", "sort_center", "sort_mirror"):
+                    np.testing.assert_array_equal(getattr(table, name)(fus_slice=fus_slice),
+                                                  getattr(legacy, name)(table, fus_slice=fus_slice))
+
+    def test_memmap_matches_loaded_data(self):
+        for table in self.Tables:
+            mapped = TableData(table.File.Name, memmap=True)
+            self.assertTrue(mapped.isFileAnalyzeComplete)
+            np.testing.assert_array_equal(mapped.Data, table.Data)
+            del mapped
+
+
+if __name__ == '__main__':
+    unittest.main()
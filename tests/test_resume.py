@@ -0,0 +1,106 @@
+import os
+import shutil
+import tempfile
+import unittest
+from pydicom.dataset import FileDataset
+try:
+    from pydicom.dataset import FileMetaDataset
+except ImportError:
+    # before pydicom 2.0
+    from pydicom.dataset import Dataset as FileMetaDataset
+from bat.DirectoryHandler import DirectoryHandler
+from bat.IndexHandler import ScanIndexHandler
+
+
+def write_header(name, instance, study=r"Band Assessment", serial="80012", date_time="20180504112233"):
+    """
+    Write a dicom file with the header fields read by DirectoryHandler, without pixel data.
+    :return: the uid of the file, see DicomHandler.Uid
+    """
+    meta = FileMetaDataset()
+    meta.MediaStorageSOPClassUID = "1.2.840.10008.5.1.4.1.1.2"
+    meta.MediaStorageSOPInstanceUID = "1.2.3." + str(instance)
+    meta.TransferSyntaxUID = "1.2.840.10008.1.2.1"
+    data = FileDataset(name, {}, file_meta=meta, preamble=b"\0" * 128)
+    data.is_little_endian = True
+    data.is_implicit_VR = False
+    data.add_new(0x00181000, "LO", serial)
+    data.StudyDescription = study
+    data.InstanceNumber = instance
+    data.add_new(0x0008002a, "DT", date_time)
+    data.save_as(name)
+    return serial + date_time + str(instance)
+
+
+class ResumeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.Directory = tempfile.mkdtemp()
+        self.Input = os.path.join(self.Directory, "input")
+        os.mkdir(self.Input)
+        self.Files = {}
+        for instance in (1, 2, 3):
+            name = os.path.join(self.Input, str(instance) + ".dcm")
+            self.Files[name] = write_header(name, instance)
+        self.Other = os.path.join(self.Input, "other.dcm")
+        write_header(self.Other, 4, study="Head")
+        self.Index = ScanIndexHandler(os.path.join(self.Directory, "index.sqlite3.db"))
+
+    def tearDown(self):
+        self.Index.close()
+        shutil.rmtree(self.Directory)
+
+    def found(self, **kwargs):
+        """
+        :return: a tuple as (sorted found files, number of skipped files)
+        """
+        files = DirectoryHandler(self.Input, index=self.Index, **kwargs)
+        return sorted(files.Dicom_File_Path), files.Skipped_Quantity
+
+    def test_stored_uids_are_skipped(self):
+        first = os.path.join(self.Input, "1.dcm")
+        # a copy of a found file has the same uid
+        copy = os.path.join(self.Input, "copy.dcm")
+        shutil.copyfile(os.path.join(self.Input, "2.dcm"), copy)
+        known_uids = {self.Files[first]}
+        found, skipped = self.found(known_uids=known_uids)
+        self.assertEqual(len(found), 2)
+        self.assertNotIn(first, found)
+        self.assertEqual(skipped, 2)
+        self.assertEqual(known_uids, set(self.Files.values()))
+
+    def test_resume_skips_done_files(self):
+        found, skipped = self.found(resume=True)
+        self.assertEqual(found, sorted(self.Files))
+        self.assertEqual(skipped, 0)
+        # the other study is not pending work
+        self.assertEqual(self.Index.lookup(self.Other)[1], ScanIndexHandler.Status_Skipped)
+        done = os.path.join(self.Input, "1.dcm")
+        failed = os.path.join(self.Input, "2.dcm")
+        self.Index.set_status(done, ScanIndexHandler.Status_Done)
+        self.Index.set_status(failed, ScanIndexHandler.Status_Failed)
+        self.assertEqual(self.Index.count(self.Input, (ScanIndexHandler.Status_New,
+                                                       ScanIndexHandler.Status_Failed)), 2)
+
+        found, skipped = self.found(resume=True)
+        self.assertEqual(found, sorted(set(self.Files) - {done}))
+        self.assertEqual(skipped, 1)
+        # a changed file is analyzed again
+        write_header(done, 1, date_time="20180504112233.5")
+        found, skipped = self.found(resume=True)
+        self.assertEqual(found, sorted(self.Files))
+        self.assertEqual(skipped, 0)
+
+    def test_rerun_finds_done_files(self):
+        self.found(resume=True)
+        for name in self.Files:
+            self.Index.set_status(name, ScanIndexHandler.Status_Done)
+        found, skipped = self.found(resume=True)
+        self.assertEqual((found, skipped), ([], 3))
+        # --rerun scans without resume and known uids
+        found, skipped = self.found()
+        self.assertEqual((found, skipped), (sorted(self.Files), 0))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,48 @@
+import unittest
+import numpy as np
+from bat.ImageHandler import ImageHandler
+import legacy_reference as legacy
+
+
+def image_handler(image, center):
+    """
+    :return: an ImageHandler on a HU image, without a dicom file
+    """
+    handler = ImageHandler.__new__(ImageHandler)
+    handler.ImageHU = image
+    handler.Center = center
+    return handler
+
+
+class RoiSearchTest(unittest.TestCase):
+
+    def test_min_search_matches_loop_on_ties(self):
+        # integer values give many equal ROI means, the first minimum must be kept
+        random = np.random.RandomState(0)
+        for _ in range(40):
+            image = random.randint(0, 3, (128, 128)).astype(np.float64)
+            for radius, deviation in ((3, 3), (5, 4), (6, 2)):
+                handler = image_handler(image, (64, 64))
+                expected = legacy.find_center_roi_min(image, (64, 64), radius, deviation)
+                self.assertEqual(handler.find_center_roi_min(radius, deviation), expected)
+
+    def test_circle_matches_loop_on_ties(self):
+        random = np.random.RandomState(1)
+        for _ in range(20):
+            image = random.randint(0, 3, (128, 128)).astype(np.float64)
+            handler = image_handler(image, (64, 64))
+            result, pos = handler.circular_bresenham((63, 65), 12, 6)
+            expected_result, expected_pos = legacy.circular_bresenham(image, (63, 65), 12, 6)
+            self.assertEqual(result.tolist(), expected_result)
+            self.assertEqual(pos.tolist(), [list(p) for p in expected_pos])
+            # the first maximum, as evaluate_iq takes it
+            self.assertEqual(int(np.argmax(result)), expected_result.index(max(expected_result)))
+
+    def test_roi_beyond_image_raises(self):
+        handler = image_handler(np.zeros((64, 64)), (32, 32))
+        with self.assertRaises(IndexError):
+            handler.roi_measure((60, 32), 6)
+
+
+if __name__ == '__main__':
+    unittest.main()